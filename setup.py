@@ -38,8 +38,9 @@ Python bindings for the snappy compression library from Google.
 More details about Snappy library: https://google.github.io/snappy
 """
 
-packages = ['snappy']
+packages = ['snappy', 'snappy.bench']
 install_requires = ["cramjam"]
+extras_require = {"crc32c": ["crc32c"], "numpy": ["numpy"]}
 setup_requires = ['cramjam>=2.6.0']
 
 setup(
@@ -73,6 +74,7 @@ setup(
     packages=packages,
     python_requires=">=3.8",
     install_requires=install_requires,
+    extras_require=extras_require,
     setup_requires=setup_requires,
     package_dir={'': 'src'},
 )
@@ -1,17 +1,105 @@
 from __future__ import absolute_import
 
-from .snappy import (
-    compress,
-    decompress,
-    uncompress,
-    stream_compress,
-    stream_decompress,
-    StreamCompressor,
-    StreamDecompressor,
-    UncompressError,
-    HadoopStreamCompressor,
-    HadoopStreamDecompressor,
-    isValidCompressed,
-)
+import importlib
+
+# The public names and the submodules defining them. Submodules are only
+# imported when one of their names is first used, so that `import snappy`
+# stays cheap for short-lived processes: cramjam is loaded on the first
+# (de)compression, asyncio only by the async functions.
+_EXPORTS = {
+    ".snappy": (
+        "compress",
+        "decompress",
+        "uncompress",
+        "compress_into",
+        "decompress_into",
+        "uncompress_into",
+        "compress_many",
+        "decompress_many",
+        "uncompress_many",
+        "max_compressed_length",
+        "uncompressed_length",
+        "stream_compress",
+        "stream_decompress",
+        "StreamCompressor",
+        "StreamDecompressor",
+        "UncompressError",
+        "HadoopStreamCompressor",
+        "HadoopStreamDecompressor",
+        "isValidCompressed",
+    ),
+    ".snappy_formats": (
+        "compress_file",
+        "decompress_file",
+    ),
+    ".snappy_async": (
+        "aiter_compress",
+        "aiter_decompress",
+        "async_stream_compress",
+        "async_stream_decompress",
+    ),
+    ".snappy_iter": (
+        "iter_compress",
+        "iter_decompress",
+    ),
+    ".snappy_file": (
+        "open",
+        "SnappyFile",
+    ),
+    ".snappy_index": (
+        "FramedIndex",
+        "SeekableFramedReader",
+    ),
+    ".snappy_transcode": (
+        "transcode",
+    ),
+    ".snappy_pool": (
+        "BufferPool",
+        "ContextPool",
+    ),
+    ".snappy_array": (
+        "compress_array",
+        "decompress_array",
+        "shuffle_bytes",
+        "unshuffle_bytes",
+    ),
+    ".snappy_crc32c": (
+        "crc32c",
+        "masked_crc32c",
+    ),
+    ".snappy_dict": (
+        "Dictionary",
+        "train_dictionary",
+        "dictionary_id",
+        "decompress_with_dictionaries",
+    ),
+    ".snappy_metrics": (
+        "Metrics",
+        "enable_metrics",
+        "disable_metrics",
+    ),
+}
+
+_MODULE_OF = {name: module for module, names in _EXPORTS.items()
+              for name in names}
+
+__all__ = list(_MODULE_OF)
 
 __version__ = '0.7.1'
+
+
+def __getattr__(name):
+    if "." + name in _EXPORTS:
+        # submodules, which the eager imports used to make attributes too
+        return importlib.import_module("." + name, __name__)
+    module = _MODULE_OF.get(name)
+    if module is None:
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
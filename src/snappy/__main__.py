@@ -2,10 +2,196 @@ from __future__ import absolute_import
 
 import argparse
 import io
+import os
 import sys
+import time
 
 from . import snappy_formats as formats
-from .snappy import UncompressError
+from .snappy import _STREAM_TO_STREAM_BLOCK_SIZE, UncompressError
+
+_SUFFIX = ".sz"
+_SIZE_UNITS = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30}
+# seconds between progress updates
+_PROGRESS_INTERVAL = 0.5
+
+
+def _parse_size(text):
+    """Parse a byte count such as 65536, 256K or 4M."""
+    text = text.strip().upper().rstrip("B")
+    unit = text[-1:] if text[-1:] in _SIZE_UNITS else ""
+    try:
+        size = int(text[:len(text) - len(unit)]) * _SIZE_UNITS[unit]
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid size: {!r}".format(text))
+    if size <= 0:
+        raise argparse.ArgumentTypeError("size must be positive")
+    return size
+
+
+class _Reporter():
+    """Prints -v progress and summary lines to stderr."""
+
+    def __init__(self, stream=sys.stderr):
+        self.stream = stream
+        self.live = stream.isatty()
+
+    def start(self, name, src, dst, compress):
+        self.name = name
+        self.src = src
+        self.dst = dst
+        self.compress = compress
+        self.started = self.updated = time.perf_counter()
+
+    def _speed(self, now):
+        # throughput on the uncompressed side
+        plain = self.src if self.compress else self.dst
+        return plain.count / 2**20 / max(now - self.started, 1e-9)
+
+    def progress(self):
+        now = time.perf_counter()
+        if not self.live or now - self.updated < _PROGRESS_INTERVAL:
+            return
+        self.updated = now
+        self.stream.write("\r{}: {:.1f} MB read, {:.1f} MB/s".format(
+            self.name, self.src.count / 2**20, self._speed(now)))
+        self.stream.flush()
+
+    def done(self):
+        now = time.perf_counter()
+        plain, packed = self.src.count, self.dst.count
+        if not self.compress:
+            plain, packed = packed, plain
+        ratio = packed / plain if plain else 1.0
+        self.stream.write(
+            "{}{}: {} -> {} bytes, ratio {:.1%}, {:.1f} MB/s\n".format(
+                "\r" if self.live else "", self.name, self.src.count,
+                self.dst.count, ratio, self._speed(now)))
+        self.stream.flush()
+        return plain, packed
+
+
+def _method_kwargs(format, args):
+    # the raw format is a single buffer, always read whole
+    if format == "raw":
+        return {}
+    kwargs = {'blocksize': args.blocksize}
+    if format == "framing" or args.compress:
+        kwargs['workers'] = args.workers
+    if format == "hadoop" and args.compress:
+        kwargs['subblock_size'] = args.subblock_size
+    return kwargs
+
+
+def _process(args, fin, fout, name, reporter=None):
+    """(De)compress fin into fout as the command line arguments say."""
+    if reporter is not None:
+        fin = formats._Counter(fin, reporter.progress)
+        fout = formats._Counter(fout)
+        # transcoding has no uncompressed side, rate it by its input
+        reporter.start(name, fin, fout, not args.decompress)
+    form = args.target_format
+    if args.transcode:
+        from .snappy_transcode import transcode
+        transcode(fin, fout, form, args.transcode, blocksize=args.blocksize)
+        if reporter is not None:
+            return reporter.done()
+        return
+    additional_args = {}
+    if args.compress:
+        form = "framing" if form == "auto" else form
+        method = formats.get_compress_function(form)
+    else:
+        if form == "auto":
+            form, _, read_chunk = formats.detect_format(fin)
+            additional_args['start_chunk'] = read_chunk
+        method = formats.get_decompress_function(form, fin)
+    additional_args.update(_method_kwargs(form, args))
+    method(fin, fout, **additional_args)
+    if reporter is not None:
+        return reporter.done()
+
+
+def _batch_jobs(paths, compress, suffix, output_dir):
+    """Yield (source, destination) path pairs for the batch mode. Directories
+    are walked recursively, picking files without suffix to compress and
+    files with it to decompress or transcode (compress is None).
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    # decompressing and transcoding (compress is None)
+                    # both pick the files with the suffix
+                    if name.endswith(suffix) == bool(compress):
+                        continue
+                    src = os.path.join(root, name)
+                    if output_dir is None:
+                        dst = src
+                    else:
+                        dst = os.path.join(output_dir,
+                                           os.path.relpath(src, path))
+                    yield src, _output_name(dst, compress, suffix)
+        else:
+            if output_dir is None:
+                dst = path
+            else:
+                dst = os.path.join(output_dir, os.path.basename(path))
+            yield path, _output_name(dst, compress, suffix)
+
+
+def _output_name(path, compress, suffix):
+    if compress is None:
+        return path
+    if compress:
+        return path + suffix
+    if not path.endswith(suffix):
+        raise ValueError("{} does not end with {}".format(path, suffix))
+    return path[:-len(suffix)]
+
+
+def _run_batch(args, parser, reporter):
+    failed = 0
+    total_plain = total_packed = 0
+    started = time.perf_counter()
+    try:
+        compress = None if args.transcode else args.compress
+        jobs = list(_batch_jobs(args.files, compress, args.suffix,
+                                args.output_dir))
+    except ValueError as err:
+        parser.error(str(err))
+    for src, dst in jobs:
+        if not args.force and os.path.exists(dst):
+            sys.stderr.write("{}: {} already exists, skipped\n".format(
+                src, dst))
+            failed += 1
+            continue
+        parent = os.path.dirname(dst)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        try:
+            with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+                sizes = _process(args, fin, fout, src, reporter)
+        except (OSError, UncompressError) as err:
+            sys.stderr.write("{}: {}\n".format(src, err))
+            if os.path.exists(dst):
+                os.remove(dst)
+            failed += 1
+            continue
+        if sizes is not None:
+            total_plain += sizes[0]
+            total_packed += sizes[1]
+        if args.remove:
+            os.remove(src)
+    if reporter is not None:
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        ratio = total_packed / total_plain if total_plain else 1.0
+        sys.stderr.write(
+            "total: {} -> {} bytes, ratio {:.1%}, {:.1f} MB/s\n".format(
+                total_plain, total_packed, ratio,
+                total_plain / 2**20 / elapsed))
+    if failed:
+        sys.exit("{} file(s) failed".format(failed))
 
 
 def cmdline_main():
@@ -37,9 +223,18 @@ def cmdline_main():
         action='store_true',
         help='Decompress'
     )
+    group.add_argument(
+        '-x', '--transcode',
+        metavar='FORMAT',
+        choices=["framing", "hadoop", "raw"],
+        help=(
+            'Convert to another format (framing, hadoop or raw), reusing the '
+            'compressed data where possible; -t is the input format'
+        )
+    )
 
     parser.add_argument(
-        '-t',
+        '-t', '--format',
         dest='target_format',
         default=formats.DEFAULT_FORMAT,
         choices=formats.ALL_SUPPORTED_FORMATS,
@@ -47,44 +242,123 @@ def cmdline_main():
             'Target format, default is "{}"'.format(formats.DEFAULT_FORMAT)
         )
     )
-
     parser.add_argument(
-        'infile',
-        nargs='?',
-        type=argparse.FileType(mode='rb'),
-        default=stdin,
-        help="Input file (or stdin)"
+        '-T', '--threads',
+        dest='workers',
+        type=int,
+        default=1,
+        help=(
+            'Threads (de)compressing blocks while the input is read, 0 means '
+            'one per CPU; hadoop decompression is not threaded, default is 1'
+        )
+    )
+    parser.add_argument(
+        '-b', '--block-size',
+        dest='blocksize',
+        type=_parse_size,
+        default=_STREAM_TO_STREAM_BLOCK_SIZE,
+        help=(
+            'Bytes read at a time, such as 256K or 1M; for the hadoop format '
+            'also the block size, default is {}'.format(
+                _STREAM_TO_STREAM_BLOCK_SIZE)
+        )
     )
     parser.add_argument(
-        'outfile',
-        nargs='?',
-        type=argparse.FileType(mode='wb'),
-        default=stdout,
-        help="Output file (or stdout)"
+        '--sub-block-size',
+        dest='subblock_size',
+        type=_parse_size,
+        help=(
+            'Size of the sub-blocks hadoop blocks are cut into when '
+            'compressing, default is one sub-block per block'
+        )
+    )
+    parser.add_argument(
+        '-v', '--verbose',
+        action='store_true',
+        help='Report progress, ratio and throughput on stderr'
+    )
+
+    batch = parser.add_argument_group(
+        'batch mode',
+        'With -B, every file argument is an input, and directories are '
+        'walked recursively. Outputs are written next to the inputs, or '
+        'under --output-dir, with the suffix added when compressing and '
+        'removed when decompressing. Transcoding keeps the names and needs '
+        '--output-dir.'
+    )
+    batch.add_argument(
+        '-B', '--batch',
+        action='store_true',
+        help='(De)compress many files'
+    )
+    batch.add_argument(
+        '-o', '--output-dir',
+        help='Directory to write the outputs to'
+    )
+    batch.add_argument(
+        '-S', '--suffix',
+        default=_SUFFIX,
+        help='Suffix of compressed files, default is "{}"'.format(_SUFFIX)
+    )
+    batch.add_argument(
+        '--rm',
+        dest='remove',
+        action='store_true',
+        help='Delete each input file once it has been processed'
+    )
+    batch.add_argument(
+        '-f', '--force',
+        action='store_true',
+        help='Overwrite existing output files'
+    )
+
+    parser.add_argument(
+        'files',
+        nargs='*',
+        metavar='file',
+        help=(
+            'Input file (or stdin) and output file (or stdout), or with -B '
+            'the files and directories to process'
+        )
     )
 
     args = parser.parse_args()
+    if args.workers == 0:
+        args.workers = None
+    elif args.workers < 0:
+        parser.error("argument -T/--threads: must not be negative")
+    reporter = _Reporter() if args.verbose else None
+
+    if args.batch:
+        if not args.files:
+            parser.error("batch mode needs at least one file")
+        if args.transcode and args.output_dir is None:
+            parser.error("batch transcoding needs --output-dir")
+        _run_batch(args, parser, reporter)
+        return
+
+    if len(args.files) > 2:
+        parser.error("too many files, use -B to process several")
+    files = args.files + ['-'] * (2 - len(args.files))
+    try:
+        infile = argparse.FileType(mode='rb')(files[0])
+        outfile = argparse.FileType(mode='wb')(files[1])
+    except argparse.ArgumentTypeError as err:
+        parser.error(str(err))
 
     # workaround for https://bugs.python.org/issue14156
-    if isinstance(args.infile, io.TextIOWrapper):
-        args.infile = stdin
-    if isinstance(args.outfile, io.TextIOWrapper):
-        args.outfile = stdout
+    if isinstance(infile, io.TextIOWrapper):
+        infile = stdin
+    if isinstance(outfile, io.TextIOWrapper):
+        outfile = stdout
 
-    additional_args = {}
-    if args.compress:
-        method = formats.get_compress_function(args.target_format)
-    else:
-        try:
-            method, read_chunk = formats.get_decompress_function(
-                args.target_format,
-                args.infile
-            )
-        except UncompressError as err:
-            sys.exit("Failed to get decompress function: {}".format(err))
-        additional_args['start_chunk'] = read_chunk
-
-    method(args.infile, args.outfile, **additional_args)
+    name = "stdin" if infile is stdin else files[0]
+    try:
+        _process(args, infile, outfile, name, reporter)
+    except UncompressError as err:
+        sys.exit("Failed to decompress: {}".format(err))
+    finally:
+        outfile.flush()
 
 
 if __name__ == "__main__":
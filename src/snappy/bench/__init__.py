@@ -0,0 +1,343 @@
+"""Benchmarks for python-snappy, run with
+
+    python -m snappy.bench [--quick] [--output results.json]
+                           [--baseline baseline.json] [--threshold 0.1]
+
+Every case reports throughput (MB/s of uncompressed data), p50/p99 latency of
+a single call and the peak RSS of the process after the case ran. Results
+can be saved as JSON and compared against a saved baseline, flagging the
+cases whose throughput dropped by more than a threshold.
+
+CORPORA - synthetic inputs by name: text, json, random, zeros
+make_corpus - builds one of them at a given size
+run - runs the benchmark cases, returning a results dict
+compare - lists the regressions of a results dict against a baseline
+"""
+from __future__ import absolute_import
+
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import cramjam
+
+import snappy
+from snappy import snappy_formats as formats
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_WORDS = (
+    "snappy compression library google fast stream block chunk frame "
+    "python buffer data the of and to in is that for it with as was on be "
+    "at by this had not are but from or have an they which one you were"
+).split()
+_TILE = 256 * 1024
+
+SIZES = [1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024]
+BLOCK_SIZES = [16 * 1024, 64 * 1024, 256 * 1024]
+STREAM_FORMATS = ["framing", "hadoop", "raw"]
+
+
+def _text(rng, size):
+    out = []
+    length = 0
+    while length < size:
+        line = " ".join(rng.choice(_WORDS)
+                        for _ in range(rng.randint(4, 16))) + "\n"
+        out.append(line)
+        length += len(line)
+    return "".join(out).encode("ascii")
+
+
+def _json(rng, size):
+    out = []
+    length = 0
+    while length < size:
+        line = json.dumps({
+            "ts": 1700000000 + length,
+            "level": rng.choice(["DEBUG", "INFO", "WARNING", "ERROR"]),
+            "request_id": "%016x" % rng.getrandbits(64),
+            "latency_ms": round(rng.random() * 100, 3),
+            "msg": " ".join(rng.choice(_WORDS) for _ in range(6)),
+        }) + "\n"
+        out.append(line)
+        length += len(line)
+    return "".join(out).encode("ascii")
+
+
+def _random(rng, size):
+    return rng.getrandbits(8 * size).to_bytes(size, "little")
+
+
+def _zeros(rng, size):
+    return bytes(size)
+
+
+CORPORA = {
+    "text": _text,
+    "json": _json,
+    "random": _random,
+    "zeros": _zeros,
+}
+
+
+def make_corpus(name, size, seed=0):
+    """Deterministic synthetic data of the given corpus name and size.
+
+    A 256 KiB tile is generated and repeated: snappy never looks further
+    back than 64 KiB, so the repetition does not change its behaviour.
+    """
+    tile = CORPORA[name](random.Random(seed), min(size, _TILE))[:_TILE]
+    return (tile * (size // len(tile) + 1))[:size]
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def _measure(func, nbytes, min_time, min_runs=5):
+    timings = []
+    deadline = time.perf_counter() + min_time
+    while len(timings) < min_runs or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    p50 = timings[len(timings) // 2]
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    return {
+        "mb_s": nbytes / 2**20 / p50,
+        "p50_us": p50 * 1e6,
+        "p99_us": p99 * 1e6,
+        "runs": len(timings),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _block_cases(sizes):
+    for corpus in CORPORA:
+        for size in sizes:
+            data = make_corpus(corpus, size)
+            packed = snappy.compress(data)
+            name = "block/%s/%dK" % (corpus, size // 1024)
+            yield (name + "/compress", size,
+                   lambda data=data: snappy.compress(data))
+            yield (name + "/uncompress", size,
+                   lambda packed=packed: snappy.uncompress(packed))
+
+
+def _stream_cases(size):
+    for corpus in CORPORA:
+        data = make_corpus(corpus, size)
+        for form in STREAM_FORMATS:
+            compress_func = formats.get_compress_function(form)
+            decompress_func = formats._DECOMPRESS_METHODS[form]
+            packed = io.BytesIO()
+            compress_func(io.BytesIO(data), packed)
+            packed = packed.getvalue()
+            blocksizes = BLOCK_SIZES if form != "raw" else [None]
+            for blocksize in blocksizes:
+                kwargs = {"blocksize": blocksize} if blocksize else {}
+                suffix = "/%dK" % (blocksize // 1024) if blocksize else ""
+                name = "stream/%s/%s%s" % (form, corpus, suffix)
+                yield (name + "/compress", size,
+                       lambda f=compress_func, d=data, kw=kwargs:
+                       f(io.BytesIO(d), io.BytesIO(), **kw))
+                yield (name + "/decompress", size,
+                       lambda f=decompress_func, d=packed, kw=kwargs:
+                       f(io.BytesIO(d), io.BytesIO(), **kw))
+
+
+def _messages(count, seed=0):
+    """JSON events of 200 bytes to 4 KB."""
+    rng = random.Random(seed)
+    messages = []
+    for i in range(count):
+        fields = rng.randint(3, 80)
+        event = {"id": i, "type": "event",
+                 "payload": {"k%d" % j: rng.randint(0, 1000)
+                             for j in range(fields)}}
+        messages.append(json.dumps(event).encode("ascii"))
+    return messages
+
+
+def _batch_cases(count):
+    """Small messages through compress/uncompress in a loop, against
+    compress_many and decompress_many returning lists and packed buffers.
+    """
+    messages = _messages(count)
+    nbytes = sum(map(len, messages))
+    compressed = snappy.compress_many(messages)
+    packed, offsets = snappy.compress_many(messages, packed=True)
+    yield ("batch/json/loop/compress", nbytes,
+           lambda: [snappy.compress(m) for m in messages])
+    yield ("batch/json/list/compress", nbytes,
+           lambda: snappy.compress_many(messages))
+    yield ("batch/json/packed/compress", nbytes,
+           lambda: snappy.compress_many(messages, packed=True))
+    yield ("batch/json/loop/uncompress", nbytes,
+           lambda: [snappy.uncompress(m) for m in compressed])
+    yield ("batch/json/list/uncompress", nbytes,
+           lambda: snappy.decompress_many(compressed))
+    yield ("batch/json/packed/uncompress", nbytes,
+           lambda: snappy.decompress_many(packed, offsets, packed=True))
+
+
+def _worker_counts():
+    counts = [1]
+    while counts[-1] * 2 <= (os.cpu_count() or 1):
+        counts.append(counts[-1] * 2)
+    return counts
+
+
+def _parallel_cases(size):
+    """Framed stream compression with 1, 2, 4... workers, up to the number
+    of CPUs, on half-compressible data.
+    """
+    text = make_corpus("text", size // 2)
+    noise = make_corpus("random", size // 2)
+    piece = 64 * 1024
+    data = b"".join(text[i:i + piece] + noise[i:i + piece]
+                    for i in range(0, len(text), piece))
+    for workers in _worker_counts():
+        yield ("parallel/mixed/%dw/compress" % workers, len(data),
+               lambda w=workers: snappy.stream_compress(
+                   io.BytesIO(data), io.BytesIO(), workers=w))
+
+
+def _hadoop_block_cases(size, block=4096):
+    """HadoopStreamDecompressor on a stream of small blocks, fed with reads
+    of 64 KiB up to the whole stream in a single call. Parsing is linear,
+    so the throughput should not drop as the reads grow.
+    """
+    data = make_corpus("random", block // 2) * 2 * (size // block)
+    compressor = snappy.HadoopStreamCompressor()
+    stream = b"".join(compressor.add_chunk(data[i:i + block])
+                      for i in range(0, len(data), block))
+
+    def decompress(read_size):
+        decompressor = snappy.HadoopStreamDecompressor()
+        for i in range(0, len(stream), read_size):
+            decompressor.decompress(stream[i:i + read_size])
+        decompressor.flush()
+
+    name = "hadoop/%dK-blocks/read-%s/decompress"
+    for read_size in (2**16, 2**20, 2**24):
+        if read_size < len(stream):
+            yield (name % (block // 1024, "%dK" % (read_size // 1024)),
+                   len(data), lambda r=read_size: decompress(r))
+    yield (name % (block // 1024, "all"), len(data),
+           lambda: decompress(len(stream)))
+
+
+def _transcode_cases(size):
+    data = make_corpus("text", size)
+    for source, target in (("hadoop", "framing"), ("framing", "hadoop")):
+        packed = io.BytesIO()
+        formats.get_compress_function(source)(io.BytesIO(data), packed)
+        yield ("transcode/text/%s-%s" % (source, target), size,
+               lambda d=packed.getvalue(), s=source, t=target:
+               snappy.transcode(io.BytesIO(d), io.BytesIO(), s, t))
+
+
+def _cli_cases(size, tmpdir):
+    paths = [os.path.join(tmpdir, name) for name in ("in", "sz", "out")]
+    with open(paths[0], "wb") as f:
+        f.write(make_corpus("text", size))
+    cli = [sys.executable, "-m", "snappy"]
+    yield ("cli/text/compress", size,
+           lambda: subprocess.check_call(cli + ["-c", paths[0], paths[1]]))
+    # auto-detects the format, the default
+    yield ("cli/text/decompress", size,
+           lambda: subprocess.check_call(cli + ["-d", paths[1], paths[2]]))
+
+
+def _startup_cases(tmpdir):
+    """Start-up cost for short-lived processes: fresh interpreters
+    importing snappy, making a first call (which loads the codec) and
+    running the command line tool on a tiny file. Each run counts as 1 MiB,
+    so that their MB/s is the number of runs per second.
+    """
+    path = os.path.join(tmpdir, "tiny")
+    with open(path, "wb") as f:
+        f.write(b"hello snappy\n" * 10)
+    python = [sys.executable]
+    yield ("startup/import", 2**20,
+           lambda: subprocess.check_call(python + ["-c", "import snappy"]))
+    yield ("startup/compress", 2**20,
+           lambda: subprocess.check_call(
+               python + ["-c", "import snappy; snappy.compress(b'snappy')"]))
+    yield ("startup/cli/compress", 2**20,
+           lambda: subprocess.check_call(
+               python + ["-m", "snappy", "-c", path, os.devnull]))
+
+
+def run(quick=False, match=None, log=None):
+    """Run all benchmark cases whose name contains match (all by default),
+    calling log(name, result) after each one.
+
+    quick uses smaller inputs and shorter timings, for smoke testing.
+    """
+    min_time = 0.05 if quick else 0.5
+    sizes = SIZES[:3] if quick else SIZES
+    stream_size = (1 if quick else 16) * 2**20
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cases = [(_block_cases(sizes), min_time, 5),
+                 (_stream_cases(stream_size), min_time, 5),
+                 (_transcode_cases(stream_size), min_time, 5),
+                 (_hadoop_block_cases((4 if quick else 64) * 2**20),
+                  min_time, 3),
+                 (_batch_cases(2000 if quick else 20000), min_time, 5),
+                 (_parallel_cases(stream_size), min_time, 5),
+                 (_cli_cases(stream_size, tmpdir), 0, 3 if quick else 5),
+                 (_startup_cases(tmpdir), 0, 3 if quick else 20)]
+        for group, group_min_time, min_runs in cases:
+            for name, nbytes, func in group:
+                if match is not None and match not in name:
+                    continue
+                results[name] = _measure(func, nbytes, group_min_time,
+                                         min_runs)
+                if log is not None:
+                    log(name, results[name])
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "snappy": snappy.__version__,
+            "cramjam": getattr(cramjam, "__version__", None),
+            "quick": quick,
+        },
+        "results": results,
+    }
+
+
+def compare(results, baseline, threshold=0.1):
+    """Compare two results dicts returned by run (or loaded from their
+    JSON), returning (name, baseline MB/s, current MB/s) for every case
+    present in both whose throughput dropped by more than threshold.
+    """
+    regressions = []
+    old = baseline["results"]
+    for name, result in results["results"].items():
+        if name not in old:
+            continue
+        before, after = old[name]["mb_s"], result["mb_s"]
+        if after < before * (1 - threshold):
+            regressions.append((name, before, after))
+    return regressions
@@ -0,0 +1,70 @@
+from __future__ import absolute_import
+
+import argparse
+import json
+import sys
+
+from . import compare, run
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m snappy.bench",
+        description="Benchmark python-snappy"
+    )
+    parser.add_argument(
+        '--quick',
+        action='store_true',
+        help='Smaller inputs and shorter timings'
+    )
+    parser.add_argument(
+        '-k',
+        dest='match',
+        help='Only run cases whose name contains this string'
+    )
+    parser.add_argument(
+        '--output',
+        help='Write the results as JSON to this file'
+    )
+    parser.add_argument(
+        '--baseline',
+        help='Compare against results saved with --output'
+    )
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.1,
+        help='Throughput drop flagged as a regression, default is 0.1 (10%%)'
+    )
+    args = parser.parse_args()
+
+    print("{:<40} {:>10} {:>12} {:>12} {:>10}".format(
+        "case", "MB/s", "p50 us", "p99 us", "RSS MB"))
+
+    def log(name, result):
+        rss = result["peak_rss_mb"]
+        print("{:<40} {:>10.1f} {:>12.1f} {:>12.1f} {:>10}".format(
+            name, result["mb_s"], result["p50_us"], result["p99_us"],
+            "-" if rss is None else "%.1f" % rss))
+        sys.stdout.flush()
+
+    results = run(quick=args.quick, match=args.match, log=log)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for name, before, after in regressions:
+            print("REGRESSION {}: {:.1f} -> {:.1f} MB/s ({:+.0%})".format(
+                name, before, after, after / before - 1))
+        if regressions:
+            sys.exit(1)
+        print("No regressions against {}".format(args.baseline))
+
+
+if __name__ == "__main__":
+    main()
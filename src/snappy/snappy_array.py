@@ -0,0 +1,152 @@
+"""Compression of typed arrays, such as numpy arrays and Arrow buffers.
+
+compress_array - compresses the memory of an array, optionally shuffled
+decompress_array - decompresses into a new or preallocated numpy array
+shuffle_bytes, unshuffle_bytes - the byte-shuffle filter, as in Blosc
+
+Numeric data compresses poorly byte by byte: the low bytes of neighbouring
+values differ while their high bytes repeat. Shuffling groups the first
+byte of every item, then the second byte of every item, and so on, turning
+those repeats into long runs that snappy compresses well and decompresses
+quickly.
+
+Anything supporting the buffer protocol can be compressed; numpy is only
+needed by decompress_array, and imported when it is called. Shuffling uses
+numpy when it has been imported, and slower byte slicing otherwise.
+"""
+from __future__ import absolute_import
+
+import sys
+
+from .snappy import (
+    _check_output_size, compress, decompress, decompress_into,
+    uncompressed_length
+)
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("decompress_array requires numpy")
+    return numpy
+
+
+def _bytes_view(data):
+    """C-contiguous byte view of data, and the size of its items."""
+    view = memoryview(data)
+    if not view.c_contiguous:
+        view = memoryview(_numpy().ascontiguousarray(data))
+    return view.cast("B"), view.itemsize
+
+
+def _loaded_numpy():
+    """numpy if something imported it already: it speeds up shuffling, but
+    is not worth its import time otherwise.
+    """
+    return sys.modules.get("numpy")
+
+
+def shuffle_bytes(data, itemsize):
+    """Byte-shuffle data made of items of itemsize bytes: the first byte of
+    every item comes first, then the second bytes, and so on. Trailing bytes
+    that do not make a whole item are kept as they are.
+    """
+    view = memoryview(data).cast("B")
+    if itemsize <= 1:
+        return bytes(view)
+    end = len(view) - len(view) % itemsize
+    count = end // itemsize
+    out = bytearray(len(view))
+    np = _loaded_numpy()
+    if np is not None:
+        src = np.frombuffer(view, np.uint8, end).reshape(count, itemsize)
+        np.frombuffer(out, np.uint8, end).reshape(itemsize, count)[:] = src.T
+    else:
+        for i in range(itemsize):
+            out[i * count:(i + 1) * count] = view[i:end:itemsize]
+    out[end:] = view[end:]
+    return bytes(out)
+
+
+def unshuffle_bytes(data, itemsize, out=None):
+    """Reverse shuffle_bytes, writing into the writable buffer out, of the
+    same length as data, if given. Returns the unshuffled bytes, or out.
+    """
+    view = memoryview(data).cast("B")
+    result = bytearray(len(view)) if out is None else out
+    target = memoryview(result).cast("B")
+    if len(target) != len(view):
+        raise ValueError("out must be as long as data")
+    if itemsize <= 1:
+        target[:] = view
+    else:
+        end = len(view) - len(view) % itemsize
+        count = end // itemsize
+        np = _loaded_numpy()
+        if np is not None:
+            src = np.frombuffer(view, np.uint8, end).reshape(itemsize, count)
+            dst = np.frombuffer(target, np.uint8, end)
+            dst.reshape(count, itemsize)[:] = src.T
+        else:
+            for i in range(itemsize):
+                target[i:end:itemsize] = view[i * count:(i + 1) * count]
+        target[end:] = view[end:]
+    if out is None:
+        return bytes(result)
+    return out
+
+
+def compress_array(arr, shuffle=False):
+    """Compress the memory of arr, any object supporting the buffer protocol
+    such as a numpy array or an Arrow buffer, in the raw format.
+
+    With shuffle=True, the bytes are shuffled by the item size of arr first;
+    decompress_array must then be called with shuffle=True too.
+    """
+    view, itemsize = _bytes_view(arr)
+    if shuffle:
+        return compress(shuffle_bytes(view, itemsize))
+    return compress(view)
+
+
+def decompress_array(data, dtype=None, shape=None, out=None, shuffle=False,
+                     max_output_size=None):
+    """Decompress data, as returned by compress_array, into a numpy array.
+
+    The data is written into out, a C-contiguous numpy array of the right
+    size, if given; otherwise into a new array of the given dtype and shape
+    (by default one dimensional). The array is returned either way, without
+    going through an intermediate bytes object unless shuffle is True.
+
+    With max_output_size, UncompressError is raised instead of allocating an
+    array for more than that many bytes.
+    """
+    size = uncompressed_length(data)
+    if out is None:
+        np = _numpy()
+        dtype = np.dtype(dtype)
+        if shape is None:
+            if size % dtype.itemsize:
+                raise ValueError(
+                    "Uncompressed size {} is not a multiple of the item "
+                    "size {}".format(size, dtype.itemsize))
+            shape = (size // dtype.itemsize,)
+        _check_output_size(size, max_output_size)
+        nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        if nbytes != size:
+            raise ValueError(
+                "Uncompressed size {} does not match {} bytes of {} {}"
+                .format(size, nbytes, shape, dtype))
+        out = np.empty(shape, dtype)
+    elif out.nbytes != size:
+        raise ValueError("out holds {} bytes, the data {}".format(
+            out.nbytes, size))
+    elif not (out.flags.c_contiguous and out.flags.writeable):
+        raise ValueError("out must be a writable C-contiguous array")
+    view = memoryview(out).cast("B")
+    if shuffle:
+        unshuffle_bytes(decompress(data), out.itemsize, view)
+    else:
+        decompress_into(data, view)
+    return out
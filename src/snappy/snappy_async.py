@@ -0,0 +1,130 @@
+"""asyncio counterparts of the stream functions.
+
+aiter_compress, aiter_decompress - async generators turning a source of
+    bytes into compressed/decompressed chunks
+async_stream_compress, async_stream_decompress - copy from a source into a
+    destination, like stream_compress and stream_decompress
+
+A source is either an object with a coroutine read(n) method, such as
+asyncio.StreamReader, or an async iterable of bytes. A destination has a
+write method, which may be a coroutine, and optionally a coroutine drain
+method, such as asyncio.StreamWriter.
+
+Blocks of at least _EXECUTOR_THRESHOLD bytes are (de)compressed in an
+executor, so the event loop is not blocked while the codec runs; smaller
+blocks are cheaper to handle inline.
+"""
+from __future__ import absolute_import
+
+import asyncio
+import inspect
+
+from .snappy import (
+    _STREAM_TO_STREAM_BLOCK_SIZE, StreamCompressor, StreamDecompressor
+)
+from .snappy_iter import _split_blocks
+
+_EXECUTOR_THRESHOLD = 16 * 1024
+
+
+async def _run(executor, func, data):
+    if len(data) < _EXECUTOR_THRESHOLD:
+        return func(data)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, func, data)
+
+
+async def _iter_source(src, blocksize):
+    if hasattr(src, "read"):
+        while True:
+            buf = await src.read(blocksize)
+            if not buf: break
+            yield buf
+    else:
+        async for buf in src:
+            if buf: yield buf
+
+
+async def _iter_blocks(src, blocksize):
+    """Re-block the source into blocksize pieces, so that small reads do
+    not turn into small compressed chunks; the async counterpart of
+    snappy_iter._iter_blocks.
+    """
+    pending = bytearray()
+    async for buf in _iter_source(src, blocksize):
+        for block in _split_blocks(pending, buf, blocksize):
+            yield block
+    if pending:
+        yield bytes(pending)
+
+
+async def _write(dst, buf):
+    result = dst.write(buf)
+    if inspect.isawaitable(result):
+        await result
+    drain = getattr(dst, "drain", None)
+    if drain is not None:
+        await drain()
+
+
+async def aiter_compress(src,
+                         blocksize=_STREAM_TO_STREAM_BLOCK_SIZE,
+                         compressor_cls=StreamCompressor,
+                         executor=None):
+    """Yield the compressed form of the data read from src.
+
+    :param compressor_cls: class that implements `add_chunk` and `flush`
+        methods like StreamCompressor or HadoopStreamCompressor
+    :param executor: concurrent.futures executor for large blocks, None
+        means the loop's default executor
+    """
+    compressor = compressor_cls()
+    async for block in _iter_blocks(src, blocksize):
+        buf = await _run(executor, compressor.add_chunk, block)
+        if buf: yield buf
+    buf = compressor.flush()
+    if buf: yield buf
+
+
+async def aiter_decompress(src,
+                           blocksize=_STREAM_TO_STREAM_BLOCK_SIZE,
+                           decompressor_cls=StreamDecompressor,
+                           executor=None):
+    """Yield the decompressed data of the compressed stream read from src.
+
+    :param decompressor_cls: class that implements `decompress` and
+        `flush` methods like StreamDecompressor or HadoopStreamDecompressor
+    :param executor: concurrent.futures executor for large blocks, None
+        means the loop's default executor
+    """
+    decompressor = decompressor_cls()
+    async for buf in _iter_source(src, blocksize):
+        buf = await _run(executor, decompressor.decompress, buf)
+        if buf: yield buf
+    decompressor.flush()  # makes sure the stream ended well
+
+
+async def async_stream_compress(src,
+                                dst,
+                                blocksize=_STREAM_TO_STREAM_BLOCK_SIZE,
+                                compressor_cls=StreamCompressor,
+                                executor=None):
+    """Reads data from src, compresses it, and writes it to dst, awaiting
+    dst.drain() after every write when it exists.
+    """
+    async for buf in aiter_compress(src, blocksize, compressor_cls,
+                                    executor):
+        await _write(dst, buf)
+
+
+async def async_stream_decompress(src,
+                                  dst,
+                                  blocksize=_STREAM_TO_STREAM_BLOCK_SIZE,
+                                  decompressor_cls=StreamDecompressor,
+                                  executor=None):
+    """Reads data from src, decompresses it, and writes it to dst, awaiting
+    dst.drain() after every write when it exists.
+    """
+    async for buf in aiter_decompress(src, blocksize, decompressor_cls,
+                                      executor):
+        await _write(dst, buf)
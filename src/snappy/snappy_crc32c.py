@@ -0,0 +1,71 @@
+"""CRC-32C (Castagnoli) checksums, as stored in framing format chunks.
+
+crc32c - checksum of a buffer, optionally continuing a previous checksum
+masked_crc32c - the masked checksum written in framing chunk headers
+BACKEND - name of the implementation in use
+HARDWARE - True if the implementation is accelerated (SSE4.2, ARMv8 CRC)
+
+cramjam verifies and writes chunk checksums itself but does not expose
+them, so this module is used where python-snappy builds chunks on its own,
+and exported as snappy.crc32c and snappy.masked_crc32c for tools that check
+or rewrite frames. The optional crc32c (pip install python-snappy[crc32c])
+or google-crc32c packages are used when installed, both run on SSE4.2 or
+ARMv8 CRC instructions where the CPU has them; otherwise a table driven pure
+Python version, which is orders of magnitude slower, keeps things working.
+"""
+from __future__ import absolute_import
+
+_POLY = 0x82F63B78
+_MASK_DELTA = 0xA282EAD8
+
+try:
+    import crc32c as _crc32c_module
+
+    def crc32c(data, crc=0):
+        return _crc32c_module.crc32c(data, crc)
+
+    BACKEND = "crc32c"
+    HARDWARE = bool(getattr(_crc32c_module, "hardware_based", False))
+except ImportError:
+    try:
+        import google_crc32c as _google_crc32c
+
+        def crc32c(data, crc=0):
+            return _google_crc32c.extend(crc, data)
+
+        BACKEND = "google-crc32c"
+        HARDWARE = _google_crc32c.implementation == "c"
+    except ImportError:
+        _TABLE = []
+
+        def _build_table():
+            # built on first use rather than on import; filled in one step
+            # so that other threads never see part of it
+            table = []
+            for n in range(256):
+                for _ in range(8):
+                    n = (n >> 1) ^ _POLY if n & 1 else n >> 1
+                table.append(n)
+            _TABLE[:] = table
+
+        def crc32c(data, crc=0):
+            table = _TABLE
+            if not table:
+                _build_table()
+            crc ^= 0xFFFFFFFF
+            for byte in memoryview(data).cast("B"):
+                crc = table[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+            return crc ^ 0xFFFFFFFF
+
+        BACKEND = "python"
+        HARDWARE = False
+
+crc32c.__doc__ = """CRC-32C of the buffer 'data', continuing from 'crc'."""
+
+
+def masked_crc32c(data):
+    """CRC-32C of 'data' masked as the framing format specifies, so that
+    checksums of data containing checksums are not degenerate.
+    """
+    crc = crc32c(data)
+    return (((crc >> 15) | (crc << 17)) + _MASK_DELTA) & 0xFFFFFFFF
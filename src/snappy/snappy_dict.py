@@ -0,0 +1,314 @@
+"""Preset dictionaries for small messages.
+
+train_dictionary - builds a Dictionary from sample messages
+Dictionary - compresses and decompresses messages against a shared prefix
+dictionary_id - the id of the dictionary a message was compressed with
+decompress_with_dictionaries - decompresses with the dictionary it names
+
+Snappy finds repeats only within the data being compressed, so short
+messages such as JSON events compress poorly: every message spells out the
+keys again. A dictionary holds what messages have in common. Each message
+is compressed after it, as if both were one buffer, so the message can copy
+from the dictionary; the elements encoding the dictionary itself are then
+cut off, and decoding puts the dictionary back in front as a literal. As
+snappy looks for repeats within 64 KiB, dictionaries are limited to
+MAX_DICTIONARY_SIZE, leaving the rest of that window to the message.
+
+A compressed message is a single chunk in the style of the framing format,
+with a chunk type of its own from the unskippable range, so that framing
+decoders reject it rather than skip it:
+
+    type 0x44 | length (3 bytes) | masked CRC-32C (4 bytes) |
+    dictionary id (4 bytes) | raw snappy data cut as described
+
+Integers are little-endian, the checksum is that of the uncompressed
+message, as in the framing format, and the dictionary id defaults to the
+CRC-32C of the dictionary.
+"""
+from __future__ import absolute_import
+
+import collections
+
+import cramjam
+
+from .snappy import (
+    _CHUNK_MAX, _FAST_CRC32C, _STREAM_HEADER_BLOCK, _check_output_size,
+    _compress, _literal_block, _uncompress, UncompressError
+)
+from .snappy_crc32c import crc32c, masked_crc32c
+from .snappy_formats import _read_uvarint
+
+MAX_DICTIONARY_SIZE = 32768
+_DICTIONARY_CHUNK = 0x44
+_HEADER_SIZE = 12
+# the 3-byte chunk length limits the size of a message
+_MAX_FRAME_BODY = 2**24 - 1
+_SEGMENT_SIZE = 8
+
+
+def _uvarint(value):
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _checksum(data):
+    """Masked CRC-32C of data, as 4 bytes."""
+    if _FAST_CRC32C or not data:
+        return masked_crc32c(data).to_bytes(4, "little")
+    # cheaper than checksumming in Python: the framed form of data holds it
+    framed = cramjam.snappy.compress(data)
+    start = len(_STREAM_HEADER_BLOCK) + 4
+    return bytes(memoryview(framed)[start:start + 4])
+
+
+def _element_bounds(buf, pos):
+    """Decode the snappy element at buf[pos]: returns the position of its
+    end, the number of bytes it outputs, and for copies their offset (None
+    for literals, whose data ends the element).
+    """
+    tag = buf[pos]
+    kind = tag & 0b11
+    if kind == 0:
+        length = tag >> 2
+        pos += 1
+        if length >= 60:
+            nbytes = length - 59
+            length = int.from_bytes(buf[pos:pos + nbytes], "little")
+            pos += nbytes
+        return pos + length + 1, length + 1, None
+    if kind == 1:
+        offset = (tag >> 5) << 8 | buf[pos + 1]
+        return pos + 2, ((tag >> 2) & 0b111) + 4, offset
+    if kind == 2:
+        return (pos + 3, (tag >> 2) + 1,
+                int.from_bytes(buf[pos + 1:pos + 3], "little"))
+    return (pos + 5, (tag >> 2) + 1,
+            int.from_bytes(buf[pos + 1:pos + 5], "little"))
+
+
+def _elements(body, limit):
+    """Positions of the elements of body, raw snappy data without its
+    length preamble, and the output produced before each of them, for the
+    elements starting within the first limit bytes of output.
+    """
+    starts, outputs = [], []
+    pos = produced = 0
+    while produced < limit and pos < len(body):
+        starts.append(pos)
+        outputs.append(produced)
+        pos, length, _ = _element_bounds(body, pos)
+        produced += length
+    return starts, outputs
+
+
+def _table_class(length):
+    # snappy sizes its hash table after the length of the 64 KiB block it
+    # compresses, which changes how the dictionary itself gets encoded
+    length = min(length, _CHUNK_MAX)
+    return min(max(1 << (length - 1).bit_length(), 256), 16384)
+
+
+def _cut(buf, prefix_length, pos=0, produced=0):
+    """The elements of buf, raw snappy data without its length preamble,
+    that produce its output after the first prefix_length bytes, parsing
+    from the element at pos, preceded by produced bytes of output. An
+    element producing bytes on both sides of that point is shortened to the
+    bytes after it.
+    """
+    while produced < prefix_length:
+        end, length, offset = _element_bounds(buf, pos)
+        produced += length
+        pos = end
+    if produced == prefix_length:
+        return bytes(buf[pos:])
+    # the last element crossed the end of the prefix
+    keep = produced - prefix_length
+    if offset is None:
+        head = _literal_block(buf[pos - keep:pos])
+        head = head[_read_uvarint(head, 0)[1]:]
+    elif offset < 65536:
+        head = bytes((((keep - 1) << 2) | 2,)) + offset.to_bytes(2, "little")
+    else:
+        head = bytes((((keep - 1) << 2) | 3,)) + offset.to_bytes(4, "little")
+    return head + bytes(buf[pos:])
+
+
+class Dictionary():
+
+    """A preset dictionary: bytes that messages are compressed after, and
+    identified by dict_id in the compressed messages (by default the CRC-32C
+    of data).
+
+        dictionary = snappy.train_dictionary(samples)
+        compressed = dictionary.compress(message)
+        assert dictionary.decompress(compressed) == message
+
+    Both sides must use the same dictionary; keep its data (or the
+    samples it was trained from) with the code, and construct it once, as
+    it caches what it needs to cut and decode messages.
+
+    The dictionary is compressed again along with every message, so a
+    message costs about as much to compress as the dictionary and the
+    message together: small dictionaries (a few KiB) are the fastest.
+    """
+
+    def __init__(self, data, dict_id=None):
+        data = bytes(data)
+        if len(data) > MAX_DICTIONARY_SIZE:
+            raise ValueError("dictionaries are limited to {} bytes".format(
+                MAX_DICTIONARY_SIZE))
+        self.data = data
+        self.dict_id = crc32c(data) if dict_id is None else dict_id
+        if not 0 <= self.dict_id < 2**32:
+            raise ValueError("dict_id must fit in 32 bits")
+        self._id_bytes = self.dict_id.to_bytes(4, "little")
+        literal = _literal_block(data)
+        # the dictionary as literal elements, without the length preamble
+        self._literal = literal[_read_uvarint(literal, 0)[1]:]
+        # the encoded dictionary and its elements by _table_class, see _skip
+        self._heads = {}
+
+    def _head(self, length):
+        """The dictionary compressed at the head of a buffer of length
+        bytes, padded out to it, and its elements.
+        """
+        size = _table_class(length)
+        head = self._heads.get(size)
+        if head is None:
+            padding = bytes(max(size - len(self.data), 16))
+            compressed = bytes(_compress(self.data + padding))
+            body = compressed[_read_uvarint(compressed, 0)[1]:]
+            head = self._heads[size] = (body,) + _elements(body,
+                                                           len(self.data))
+        return head
+
+    def _skip(self, compressed, start, length):
+        """The part of compressed, the dictionary and a message of length
+        bytes in all compressed together, encoding the message; its elements
+        begin at start.
+
+        Finding where the dictionary ends takes parsing its elements, most
+        of which are the same for every message: they are parsed once, by
+        _head, and parsing resumes after the last of them compressed starts
+        with, looked for from the end.
+        """
+        head, starts, outputs = self._head(length)
+        index = len(starts) - 1
+        step = 1
+        while index and not compressed.startswith(head[:starts[index]],
+                                                  start):
+            index = max(index - step, 0)
+            step *= 2
+        return _cut(memoryview(compressed)[start:], len(self.data),
+                    starts[index], outputs[index])
+
+    def compress(self, data, encoding='utf-8'):
+        """Compress the message data against the dictionary."""
+        if isinstance(data, str):
+            data = data.encode(encoding)
+        view = memoryview(data).cast("B")
+        compressed = bytes(_compress(self.data + view))
+        start = _read_uvarint(compressed, 0)[1]
+        if self.data:
+            body = self._skip(compressed, start, len(self.data) + len(view))
+        else:
+            body = compressed[start:]
+        body = _uvarint(len(view)) + body
+        length = 8 + len(body)
+        if length > _MAX_FRAME_BODY:
+            raise ValueError("message too large for a dictionary chunk")
+        return b"".join((bytes((_DICTIONARY_CHUNK,)),
+                         length.to_bytes(3, "little"), _checksum(view),
+                         self._id_bytes, body))
+
+    def decompress(self, data, max_output_size=None):
+        """Decompress a message compressed with this dictionary. With
+        max_output_size, messages claiming to be larger are rejected
+        before anything is allocated for them.
+        """
+        view = memoryview(data).cast("B")
+        dict_id = dictionary_id(view)
+        if dict_id != self.dict_id:
+            raise UncompressError(
+                "Compressed with dictionary {:#010x}, not {:#010x}".format(
+                    dict_id, self.dict_id))
+        if len(view) != 4 + int.from_bytes(view[1:4], "little"):
+            raise UncompressError("Invalid dictionary chunk length")
+        header = _read_uvarint(view, _HEADER_SIZE)
+        if header is None:
+            raise UncompressError("Invalid dictionary chunk")
+        length, pos = header
+        _check_output_size(length, max_output_size)
+        prefix = len(self.data)
+        block = b"".join((_uvarint(prefix + length), self._literal,
+                          view[pos:]))
+        try:
+            out = bytes(memoryview(_uncompress(block))[prefix:])
+        except cramjam.DecompressionError as err:
+            raise UncompressError from err
+        if _checksum(out) != view[4:8]:
+            raise UncompressError("Dictionary chunk checksum mismatch")
+        return out
+
+    uncompress = decompress
+
+
+def dictionary_id(data):
+    """The id of the dictionary the message data was compressed with."""
+    if len(data) < _HEADER_SIZE or data[0] != _DICTIONARY_CHUNK:
+        raise UncompressError("Not a dictionary compressed message")
+    return int.from_bytes(data[8:12], "little")
+
+
+def decompress_with_dictionaries(data, dictionaries, max_output_size=None):
+    """Decompress the message data with the dictionary it was compressed
+    with, picked by id from dictionaries, a mapping of ids to Dictionary
+    objects such as {d.dict_id: d for d in known}.
+    """
+    dict_id = dictionary_id(data)
+    try:
+        dictionary = dictionaries[dict_id]
+    except KeyError:
+        raise UncompressError(
+            "Unknown dictionary {:#010x}".format(dict_id)) from None
+    return dictionary.decompress(data, max_output_size=max_output_size)
+
+
+def train_dictionary(samples, size=4096, dict_id=None):
+    """Build a dictionary of at most size bytes from the byte strings of
+    samples, typical messages.
+
+    The dictionary strings together the pieces found in most samples, most
+    common first; a piece occurring in a single sample is never used.
+    Training on a few hundred to a few thousand messages is usually enough.
+    """
+    if not 0 < size <= MAX_DICTIONARY_SIZE:
+        raise ValueError("size must be between 1 and {}".format(
+            MAX_DICTIONARY_SIZE))
+    counts = collections.Counter()
+    width = _SEGMENT_SIZE
+    for sample in samples:
+        sample = bytes(sample)
+        # each segment counts once per sample, in order of appearance so
+        # that the overlapping segments of a common piece stay together
+        counts.update(dict.fromkeys(
+            (sample[i:i + width] for i in range(len(sample) - width + 1)),
+            1))
+    out = bytearray()
+    for segment, count in counts.most_common():
+        if count < 2:
+            break
+        if segment in out:
+            continue
+        # extend a piece whose end the segment overlaps
+        overlap = next((k for k in range(width - 1, 0, -1)
+                        if out.endswith(segment[:k])), 0)
+        piece = segment[overlap:]
+        if len(out) + len(piece) > size:
+            break
+        out += piece
+    return Dictionary(bytes(out), dict_id)
@@ -0,0 +1,307 @@
+"""File objects reading and writing snappy compressed files, in the spirit of
+gzip.open and gzip.GzipFile.
+
+open - opens a compressed file in binary or text mode
+SnappyFile - the buffered binary file object returned by open
+"""
+from __future__ import absolute_import
+
+import builtins
+import io
+
+from .snappy import (
+    _CHUNK_MAX, compress, decompress,
+    HadoopStreamCompressor, HadoopStreamDecompressor,
+    StreamCompressor, StreamDecompressor, UncompressError
+)
+from .snappy_formats import detect_format
+
+_READ_SIZE = 4 * _CHUNK_MAX
+
+
+class _RawCompressor():
+    """The raw format has no framing, so everything written is compressed
+    in one go when the file is closed.
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def add_chunk(self, data):
+        self.chunks.append(bytes(data))
+        return b""
+
+    def flush(self):
+        data, self.chunks = b"".join(self.chunks), []
+        return compress(data)
+
+
+class _RawDecompressor():
+    def __init__(self):
+        self.chunks = []
+
+    def decompress(self, data):
+        self.chunks.append(data)
+        return b""
+
+    def flush(self):
+        data, self.chunks = b"".join(self.chunks), []
+        return decompress(data)
+
+
+_COMPRESSORS = {
+    "framing": StreamCompressor,
+    "hadoop": HadoopStreamCompressor,
+    "raw": _RawCompressor,
+}
+
+_DECOMPRESSORS = {
+    "framing": StreamDecompressor,
+    "framed": StreamDecompressor,
+    "hadoop": HadoopStreamDecompressor,
+    "raw": _RawDecompressor,
+}
+
+
+class SnappyFile(io.BufferedIOBase):
+
+    """A file object compressing or decompressing on the fly.
+
+    Reading refills an internal buffer with the decompressed contents of the
+    next compressed block whenever it runs dry; readinto, readline, peek and
+    iteration all work from that buffer. Writing collects data into full
+    _CHUNK_MAX blocks before compressing them, so many small writes do not
+    produce many small chunks; flush() compresses whatever is pending.
+
+    format is "framing", "hadoop" or "raw"; for reading it may also be
+    "auto", to detect the format from the first bytes of the file. Raw files
+    are a single buffer, and cannot be opened in append mode.
+    """
+
+    def __init__(self, filename=None, mode="rb", fileobj=None,
+                 format="framing"):
+        mode = mode.replace("b", "")
+        if mode not in ("r", "w", "x", "a"):
+            raise ValueError("Invalid mode: {!r}".format(mode))
+        formats = _DECOMPRESSORS if mode == "r" else _COMPRESSORS
+        if format not in formats and not (mode == "r" and format == "auto"):
+            raise ValueError("Unknown format: {!r}".format(format))
+        if mode == "a" and format == "raw":
+            # a second raw buffer after the first could not be read back
+            raise ValueError("The raw format cannot be appended to")
+        if fileobj is None:
+            fileobj = builtins.open(filename, mode + "b")
+            self._closefp = True
+        else:
+            self._closefp = False
+        self.fileobj = fileobj
+        self.mode = mode
+        self._pos = 0
+        if mode == "r":
+            # bytes read ahead to detect the format
+            self._prefix = b""
+            if format == "auto":
+                format, _, self._prefix = detect_format(fileobj)
+            self._decompressor = _DECOMPRESSORS[format]()
+            self._buffer = b""
+            self._offset = 0
+            self._eof = False
+        else:
+            self._compressor = _COMPRESSORS[format]()
+            self._pending = bytearray()
+        self.format = format
+
+    @property
+    def name(self):
+        return self.fileobj.name
+
+    def readable(self):
+        self._check_not_closed()
+        return self.mode == "r"
+
+    def writable(self):
+        self._check_not_closed()
+        return self.mode != "r"
+
+    def seekable(self):
+        return False
+
+    def fileno(self):
+        return self.fileobj.fileno()
+
+    def tell(self):
+        """Position in the uncompressed stream."""
+        self._check_not_closed()
+        return self._pos
+
+    def _check_not_closed(self):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+
+    def _check_mode(self, reading):
+        self._check_not_closed()
+        if reading != (self.mode == "r"):
+            raise io.UnsupportedOperation(
+                "File not open for {}".format("reading" if reading
+                                              else "writing"))
+
+    # reading
+
+    def _fill(self):
+        """Refill the decompressed buffer, returns False at the end of file.
+        """
+        while self._offset >= len(self._buffer):
+            if self._eof:
+                return False
+            if self._prefix:
+                data, self._prefix = self._prefix, b""
+            else:
+                data = self.fileobj.read(_READ_SIZE)
+            if data:
+                out = self._decompressor.decompress(data)
+            else:
+                self._eof = True
+                if getattr(self._decompressor, "remains", None):
+                    raise UncompressError(
+                        "Compressed file ended in the middle of a chunk")
+                out = self._decompressor.flush()
+            self._buffer = out
+            self._offset = 0
+        return True
+
+    def _take(self, size):
+        """Consume up to size bytes of the buffer, as a zero-copy view."""
+        start = self._offset
+        self._offset = min(start + size, len(self._buffer))
+        self._pos += self._offset - start
+        return memoryview(self._buffer)[start:self._offset]
+
+    def readinto(self, b):
+        self._check_mode(reading=True)
+        with memoryview(b) as view, view.cast("B") as byte_view:
+            written = 0
+            while written < len(byte_view) and self._fill():
+                chunk = self._take(len(byte_view) - written)
+                byte_view[written:written + len(chunk)] = chunk
+                written += len(chunk)
+        return written
+
+    def readinto1(self, b):
+        self._check_mode(reading=True)
+        with memoryview(b) as view, view.cast("B") as byte_view:
+            if not byte_view or not self._fill():
+                return 0
+            chunk = self._take(len(byte_view))
+            byte_view[:len(chunk)] = chunk
+        return len(chunk)
+
+    def read(self, size=-1):
+        self._check_mode(reading=True)
+        if size is None or size < 0:
+            size = float("inf")
+        out = []
+        while size > 0 and self._fill():
+            chunk = self._take(size)
+            out.append(chunk)
+            size -= len(chunk)
+        return b"".join(out)
+
+    def read1(self, size=-1):
+        self._check_mode(reading=True)
+        if not size or not self._fill():
+            return b""
+        if size < 0:
+            size = len(self._buffer)
+        return bytes(self._take(size))
+
+    def peek(self, n=0):
+        """Return buffered data without advancing the position; at most one
+        block is decompressed to satisfy the call.
+        """
+        self._check_mode(reading=True)
+        self._fill()
+        return self._buffer[self._offset:]
+
+    def readline(self, size=-1):
+        self._check_mode(reading=True)
+        if size is None or size < 0:
+            size = float("inf")
+        out = []
+        while size > 0 and self._fill():
+            end = min(self._offset + size, len(self._buffer))
+            newline = self._buffer.find(b"\n", self._offset, end)
+            if newline >= 0:
+                out.append(self._take(newline + 1 - self._offset))
+                break
+            chunk = self._take(size)
+            out.append(chunk)
+            size -= len(chunk)
+        return b"".join(out)
+
+    # writing
+
+    def write(self, data):
+        self._check_mode(reading=False)
+        with memoryview(data) as view:
+            length = view.nbytes
+        self._pending += data
+        self._pos += length
+        while len(self._pending) >= _CHUNK_MAX:
+            self._write_block(_CHUNK_MAX)
+        return length
+
+    def _write_block(self, size):
+        out = self._compressor.add_chunk(bytes(self._pending[:size]))
+        del self._pending[:size]
+        if out:
+            self.fileobj.write(out)
+
+    def flush(self):
+        self._check_not_closed()
+        if self.mode != "r":
+            if self._pending and self.format != "raw":
+                self._write_block(len(self._pending))
+            self.fileobj.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.mode != "r":
+                if self._pending:
+                    self._write_block(len(self._pending))
+                out = self._compressor.flush()
+                if out:
+                    self.fileobj.write(out)
+        finally:
+            try:
+                super().close()
+            finally:
+                if self._closefp:
+                    self.fileobj.close()
+
+
+def open(filename, mode="rb", format="framing", encoding=None, errors=None,
+         newline=None):
+    """Open a snappy compressed file in binary or text mode, like gzip.open.
+
+    filename can be a path or an existing file object. mode is one of "r",
+    "rb", "w", "wb", "x", "xb", "a", "ab" for binary mode, or "rt", "wt",
+    "xt", "at" for text mode, which wraps the file in io.TextIOWrapper with
+    the given encoding, errors and newline.
+    """
+    if "t" in mode:
+        if "b" in mode:
+            raise ValueError("Invalid mode: %r" % (mode,))
+    elif encoding is not None or errors is not None or newline is not None:
+        raise ValueError("Argument 'encoding', 'errors' or 'newline' not "
+                         "supported in binary mode")
+    binary_mode = mode.replace("t", "")
+    if isinstance(filename, (str, bytes)) or hasattr(filename, "__fspath__"):
+        binary_file = SnappyFile(filename, binary_mode, format=format)
+    elif hasattr(filename, "read") or hasattr(filename, "write"):
+        binary_file = SnappyFile(None, binary_mode, filename, format=format)
+    else:
+        raise TypeError("filename must be a str, bytes or file object")
+    if "t" in mode:
+        return io.TextIOWrapper(binary_file, encoding, errors, newline)
+    return binary_file
@@ -2,15 +2,23 @@
 ALL_SUPPORTED_FORMATS - list of supported formats
 get_decompress_function - returns stream decompress function for a current
     format (specified or autodetected)
+sniff_format, detect_format - guess the format of a stream from a short
+    prefix, without seeking
 get_compress_function - returns compress function for a current format
     (specified or default)
+compress_file, decompress_file - memory-mapped file to file (de)compression
+    in any of the formats
 """
 from __future__ import absolute_import
 
+import mmap
+
 from .snappy import (
-    HadoopStreamDecompressor, StreamDecompressor,
+    _STREAM_HEADER_BLOCK, _check_output_size, HadoopStreamDecompressor,
     hadoop_stream_compress, hadoop_stream_decompress, raw_stream_compress,
     raw_stream_decompress, stream_compress, stream_decompress,
+    compress_into, decompress, decompress_into, uncompress,
+    max_compressed_length, uncompressed_length,
     UncompressError
 )
 
@@ -21,7 +29,7 @@ from .snappy import (
 # header.
 DEFAULT_FORMAT = "auto"
 
-ALL_SUPPORTED_FORMATS = ["framing", "auto"]
+ALL_SUPPORTED_FORMATS = ["framing", "hadoop", "raw", "auto"]
 
 _COMPRESS_METHODS = {
     "framing": stream_compress,
@@ -63,15 +71,160 @@ def check_unframed_format(fin, reset=False):
     if reset:
         fin.seek(0)
     try:
-        size = uvarint(fin)
-        assert size < 2**32 - 1
-        next_byte = fin.read(1)[0]
-        end = fin.seek(0, 2)
-        assert size < end
-        assert next_byte & 0b11 == 0 # must start with literal block
-        return True
-    except:
+        prefix = fin.read(_SNIFF_SIZE)
+    except Exception:
+        return False
+    return _plausible_raw_block(prefix, 0, _MAX_RAW_LENGTH)
+
+
+# Enough for a framing stream header, or a hadoop block and sub-block header
+# followed by the varint and first tag of the raw buffer.
+_SNIFF_SIZE = 64
+_MAX_RAW_LENGTH = 2**32 - 1
+
+
+def _read_uvarint(buf, pos):
+    """Decode the varint at buf[pos], returns (value, next position), or
+    None if it is truncated or longer than a 32-bit value allows.
+    """
+    result = 0
+    for shift in range(0, 35, 7):
+        if pos >= len(buf):
+            return None
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+    return None
+
+
+def _plausible_raw_block(buf, pos, max_length, compressed_length=None):
+    """Could buf[pos:] be the start of a raw snappy buffer decompressing to
+    at most max_length bytes, compressed_length bytes long if known?
+
+    The buffer has to start with the varint uncompressed length, followed,
+    for non-empty data, by a literal whose length fits in that length: there
+    is nothing to copy from yet.
+    """
+    start = pos
+    if compressed_length is None:
+        # the input is at least as long as what was read so far
+        compressed_length = len(buf) - start
+    header = _read_uvarint(buf, pos)
+    if header is None:
+        return False
+    length, pos = header
+    if length > max_length:
         return False
+    if length == 0:
+        return compressed_length == pos - start
+    if max_compressed_length(length) < compressed_length:
+        return False
+    if pos >= len(buf):
+        return False
+    tag = buf[pos]
+    if tag & 0b11:
+        return False
+    literal = tag >> 2
+    if literal >= 60:
+        nbytes = literal - 59
+        if pos + 1 + nbytes > len(buf):
+            return True  # cannot tell, the prefix is too short
+        literal = int.from_bytes(buf[pos + 1:pos + 1 + nbytes], "little")
+    return literal + 1 <= length
+
+
+def _verify_limit(prefix):
+    # a snappy copy element expands to at most 64 bytes out of 3, so this
+    # bounds the output of a genuine buffer without trusting its header
+    return 32 * len(prefix) + 32
+
+
+def _hadoop_confidence(prefix, complete):
+    if len(prefix) < 9:
+        return 0.0
+    block_length = int.from_bytes(prefix[:4], "big")
+    chunk_length = int.from_bytes(prefix[4:8], "big")
+    # Hadoop reads both as signed ints, while raw buffers of 128 bytes and
+    # more start with a multi-byte varint, so with the high bit set
+    if not 0 < block_length < 2**31 or not 0 < chunk_length < 2**31:
+        return 0.0
+    if chunk_length > max_compressed_length(block_length):
+        return 0.0
+    if complete:
+        try:
+            decompressor = HadoopStreamDecompressor(
+                max_output_size=_verify_limit(prefix))
+            decompressor.decompress(prefix)
+            decompressor.flush()
+        except UncompressError:
+            return 0.0
+        return 1.0
+    if not _plausible_raw_block(prefix, 8, block_length, chunk_length):
+        return 0.0
+    return 0.9
+
+
+def _raw_confidence(prefix, complete):
+    if not _plausible_raw_block(prefix, 0, _MAX_RAW_LENGTH):
+        return 0.0
+    if complete:
+        try:
+            uncompress(prefix, max_output_size=_verify_limit(prefix))
+        except UncompressError:
+            return 0.0
+        return 1.0
+    # a varint and a literal tag are a weak signature
+    return 0.5
+
+
+def sniff_format(prefix, complete=False):
+    """Guess the format of a compressed stream from its first bytes.
+
+    prefix should hold at least the first _SNIFF_SIZE bytes of the stream,
+    or all of it, in which case complete should be True and the candidate
+    formats are confirmed by decoding it.
+
+    :return: format name (str), confidence between 0 and 1 (float)
+    """
+    prefix = bytes(prefix)
+    if prefix.startswith(_STREAM_HEADER_BLOCK):
+        return "framing", 1.0
+    candidates = [
+        (_hadoop_confidence(prefix, complete), "hadoop"),
+        (_raw_confidence(prefix, complete), "raw"),
+    ]
+    # on ties, hadoop wins: its header is the stronger signature
+    confidence, form = max(candidates, key=lambda c: c[0])
+    if not confidence:
+        raise UncompressError("Can't detect format")
+    return form, confidence
+
+
+def detect_format(fin, size=_SNIFF_SIZE):
+    """Guess the format of the compressed stream fin in a single pass,
+    reading only its first size bytes, so that pipes and sockets work.
+
+    The bytes read cannot be put back, so they are returned for the
+    decompress function to use as its start_chunk:
+
+        form, confidence, prefix = detect_format(fin)
+        get_decompress_function(form, fin)(fin, fout, start_chunk=prefix)
+
+    :return: format name (str), confidence (float), bytes read (bytes)
+    """
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        buf = fin.read(remaining)
+        if not buf:
+            break
+        chunks.append(buf)
+        remaining -= len(buf)
+    prefix = b"".join(chunks)
+    form, confidence = sniff_format(prefix, complete=remaining > 0)
+    return form, confidence, prefix
 
 
 # The tuple contains an ordered sequence of a format checking function and
@@ -88,19 +241,27 @@ def guess_format_by_header(fin):
     """Tries to guess a compression format for the given input file by it's
     header.
 
+    Seekable files are rewound to where they were, other streams lose the
+    bytes read; use detect_format to get those back.
+
     :return: format name (str), stream decompress function (callable)
     """
-    if StreamDecompressor.check_format(fin):
+    start = fin.tell() if _seekable(fin) else None
+    form, _, _ = detect_format(fin)
+    if start is not None:
+        fin.seek(start)
+    if form == "framing":
         form = "framed"
-    elif HadoopStreamDecompressor.check_format(fin):
-        form = "hadoop"
-    elif check_unframed_format(fin, reset=True):
-        form = "raw"
-    else:
-        raise UncompressError("Can't detect format")
     return form, _DECOMPRESS_FORMAT_FUNCS[form]
 
 
+def _seekable(fin):
+    try:
+        return fin.seekable()
+    except AttributeError:
+        return False
+
+
 def get_decompress_function(specified_format, fin):
     if specified_format == "auto":
         format, decompress_func = guess_format_by_header(fin)
@@ -112,3 +273,134 @@ def get_compress_function(specified_format):
     if specified_format == "auto":
         return _COMPRESS_METHODS[_DEFAULT_COMPRESS_FORMAT]
     return _COMPRESS_METHODS[specified_format]
+
+
+class _Counter():
+    """Wraps a file object, counting the bytes read from or written to it,
+    and calling callback, if any, after every read. Used to report progress
+    and metrics of the stream functions.
+    """
+    def __init__(self, fileobj, callback=None):
+        self.fileobj = fileobj
+        self.callback = callback
+        self.count = 0
+
+    def read(self, size=-1):
+        buf = self.fileobj.read(size)
+        self.count += len(buf)
+        if self.callback is not None:
+            self.callback()
+        return buf
+
+    def write(self, buf):
+        self.count += len(buf)
+        return self.fileobj.write(buf)
+
+    def flush(self):
+        self.fileobj.flush()
+
+
+class _MappedReader():
+    """File-like reader over a memory map, handing out zero-copy memoryview
+    slices instead of bytes.
+    """
+    def __init__(self, view):
+        self.view = view
+        self.pos = 0
+
+    def read(self, size=-1):
+        start = self.pos
+        if size is None or size < 0:
+            self.pos = len(self.view)
+        else:
+            self.pos = min(start + size, len(self.view))
+        return self.view[start:self.pos]
+
+
+def _map_output(fout, size):
+    """Grow fout to size bytes and map it for writing."""
+    fout.truncate(size)
+    return mmap.mmap(fout.fileno(), size, access=mmap.ACCESS_WRITE)
+
+
+def _raw_file_compress(view, fout):
+    out = _map_output(fout, max_compressed_length(view))
+    try:
+        written = compress_into(view, out)
+    finally:
+        out.close()
+    fout.truncate(written)
+
+
+def _raw_file_decompress(view, fout, max_output_size=None):
+    size = uncompressed_length(view)
+    _check_output_size(size, max_output_size)
+    if not size:
+        decompress(view)  # still validates the input
+        return
+    out = _map_output(fout, size)
+    try:
+        decompress_into(view, out)
+    finally:
+        out.close()
+
+
+def _map_file(path, fout, func):
+    """Calls func with a read-only memoryview of the file at path and fout,
+    the file object opened at dst.
+    """
+    with open(path, 'rb') as fin:
+        try:
+            mapped = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files cannot be mapped
+            func(memoryview(b""), fout)
+            return
+        view = memoryview(mapped)
+        func(view, fout)
+        # on errors the traceback may still hold slices of the map, in which
+        # case closing is left to the garbage collector
+        view.release()
+        mapped.close()
+
+
+def compress_file(src_path, dst_path, format=_DEFAULT_COMPRESS_FORMAT):
+    """Compress the file at src_path into a new file at dst_path.
+
+    The input is memory-mapped and handed to the codec as zero-copy slices;
+    for the raw format the output is also written through a memory map of
+    the destination, so the file never has to fit in memory.
+    """
+    format = "framing" if format == "auto" else format
+    with open(dst_path, 'w+b') as fout:
+        if format == "raw":
+            _map_file(src_path, fout, _raw_file_compress)
+        else:
+            method = get_compress_function(format)
+            _map_file(src_path, fout,
+                      lambda view, f: method(_MappedReader(view), f))
+
+
+def decompress_file(src_path, dst_path, format=DEFAULT_FORMAT,
+                    max_output_size=None):
+    """Decompress the file at src_path into a new file at dst_path, detecting
+    the format from the header if format is "auto".
+
+    Like compress_file, the input is memory-mapped, and raw format output is
+    written through a memory map of the destination. With max_output_size,
+    UncompressError is raised instead of writing more than that many bytes.
+    """
+    if format == "auto":
+        with open(src_path, 'rb') as fin:
+            format, _, _ = detect_format(fin)
+    method = _DECOMPRESS_METHODS[format]
+    with open(dst_path, 'w+b') as fout:
+        if format == "raw":
+            _map_file(src_path, fout,
+                      lambda view, f: _raw_file_decompress(
+                          view, f, max_output_size=max_output_size))
+        else:
+            _map_file(src_path, fout,
+                      lambda view, f: method(
+                          _MappedReader(view), f,
+                          max_output_size=max_output_size))
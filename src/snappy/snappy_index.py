@@ -0,0 +1,174 @@
+"""Random access into framing format streams.
+
+FramedIndex - maps the offset of every data chunk in a framed stream to the
+    offset of its data in the uncompressed stream; can be saved to and loaded
+    from a sidecar file
+SeekableFramedReader - reads arbitrary ranges of uncompressed data, only
+    decompressing the chunks that overlap them
+"""
+from __future__ import absolute_import
+
+import bisect
+import struct
+
+from .snappy import (
+    _STREAM_HEADER_BLOCK, _decompress_frame_chunks, UncompressError
+)
+from .snappy_formats import uvarint
+
+_COMPRESSED_CHUNK = 0x00
+_UNCOMPRESSED_CHUNK = 0x01
+_INDEX_MAGIC = b"sNaPpYiX"
+_INDEX_VERSION = 1
+_INDEX_HEADER = struct.Struct("<8sIQQQ")
+
+
+class FramedIndex():
+
+    """Chunk index of a framed stream.
+
+    chunk_offsets[i] is the position of the i-th data chunk header in the
+    compressed stream and data_offsets[i] the position of its data in the
+    uncompressed stream. Stream identifier, padding and skippable chunks are
+    not indexed.
+    """
+
+    def __init__(self, chunk_offsets, data_offsets, compressed_size,
+                 uncompressed_size):
+        self.chunk_offsets = chunk_offsets
+        self.data_offsets = data_offsets
+        self.compressed_size = compressed_size
+        self.uncompressed_size = uncompressed_size
+
+    def __len__(self):
+        return len(self.chunk_offsets)
+
+    @classmethod
+    def build(cls, fin):
+        """Index the framed stream in the seekable file object fin.
+
+        Only the chunk headers and the length preamble of compressed chunks
+        are read, the chunk bodies are skipped over.
+        """
+        fin.seek(0)
+        if fin.read(len(_STREAM_HEADER_BLOCK)) != _STREAM_HEADER_BLOCK:
+            raise UncompressError("Not a framed snappy stream")
+        chunk_offsets = []
+        data_offsets = []
+        pos = len(_STREAM_HEADER_BLOCK)
+        size = 0
+        while True:
+            header = fin.read(4)
+            if not header:
+                break
+            if len(header) < 4:
+                raise UncompressError("Truncated chunk header at %d" % pos)
+            chunk_type = header[0]
+            chunk_length = int.from_bytes(header[1:4], "little")
+            if chunk_type == _COMPRESSED_CHUNK:
+                fin.seek(pos + 8)
+                try:
+                    data_length = uvarint(fin)
+                except IndexError:
+                    raise UncompressError("Truncated chunk at %d" % pos)
+            elif chunk_type == _UNCOMPRESSED_CHUNK:
+                data_length = chunk_length - 4
+            elif chunk_type < 0x80:
+                raise UncompressError(
+                    "Unskippable chunk type %#x at %d" % (chunk_type, pos))
+            else:
+                data_length = 0
+            if data_length:
+                chunk_offsets.append(pos)
+                data_offsets.append(size)
+                size += data_length
+            pos += 4 + chunk_length
+            fin.seek(pos)
+        if fin.seek(0, 2) != pos:
+            raise UncompressError("Truncated chunk at the end of the stream")
+        return cls(chunk_offsets, data_offsets, pos, size)
+
+    def save(self, path):
+        """Write the index to a sidecar file."""
+        count = len(self)
+        with open(path, "wb") as f:
+            f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, _INDEX_VERSION, count,
+                                       self.compressed_size,
+                                       self.uncompressed_size))
+            f.write(struct.pack("<%dQ" % count, *self.chunk_offsets))
+            f.write(struct.pack("<%dQ" % count, *self.data_offsets))
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written by FramedIndex.save."""
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < _INDEX_HEADER.size:
+            raise ValueError("Not a snappy index file: %s" % path)
+        magic, version, count, compressed_size, uncompressed_size = \
+            _INDEX_HEADER.unpack_from(data)
+        if magic != _INDEX_MAGIC or version != _INDEX_VERSION:
+            raise ValueError("Not a snappy index file: %s" % path)
+        if len(data) != _INDEX_HEADER.size + 16 * count:
+            raise ValueError("Truncated snappy index file: %s" % path)
+        offsets = struct.unpack_from("<%dQ" % (2 * count), data,
+                                     _INDEX_HEADER.size)
+        return cls(list(offsets[:count]), list(offsets[count:]),
+                   compressed_size, uncompressed_size)
+
+
+class SeekableFramedReader():
+
+    """Reads ranges of uncompressed data from a seekable framed stream.
+
+    If no index is given, one is built by scanning the chunk headers. The
+    last decompressed chunk is kept, so small sequential reads do not
+    decompress the same chunk over and over.
+    """
+
+    def __init__(self, fin, index=None):
+        self.fin = fin
+        if index is None:
+            index = FramedIndex.build(fin)
+        elif fin.seek(0, 2) != index.compressed_size:
+            raise ValueError("Index does not match the stream size")
+        self.index = index
+        self._cached = (None, b"")
+
+    @property
+    def size(self):
+        """Length of the uncompressed stream."""
+        return self.index.uncompressed_size
+
+    def _chunk(self, i):
+        if self._cached[0] == i:
+            return self._cached[1]
+        index = self.index
+        begin = index.chunk_offsets[i]
+        if i + 1 < len(index):
+            end = index.chunk_offsets[i + 1]
+        else:
+            end = index.compressed_size
+        self.fin.seek(begin)
+        data = _decompress_frame_chunks(self.fin.read(end - begin))
+        self._cached = (i, data)
+        return data
+
+    def read(self, offset, length):
+        """Return up to length bytes of uncompressed data starting at
+        offset; fewer at the end of the stream.
+        """
+        if offset < 0 or length < 0:
+            raise ValueError("offset and length must be non-negative")
+        end = min(offset + length, self.size)
+        if offset >= end:
+            return b""
+        data_offsets = self.index.data_offsets
+        i = bisect.bisect_right(data_offsets, offset) - 1
+        out = []
+        while i < len(data_offsets) and data_offsets[i] < end:
+            chunk = self._chunk(i)
+            start = data_offsets[i]
+            out.append(chunk[max(offset - start, 0):end - start])
+            i += 1
+        return b"".join(out)
@@ -0,0 +1,151 @@
+"""Generator counterparts of the stream functions.
+
+iter_compress - yields the compressed form of an iterable of bytes
+iter_decompress - yields the data of a compressed iterable of bytes
+
+They plug into anything producing or consuming pieces of bytes, such as
+chunked HTTP bodies, multipart uploads or message batches, without file
+objects in between, and compose with each other:
+
+    for buf in snappy.iter_decompress(snappy.iter_compress(pieces)):
+        ...
+
+Input pieces of any size are re-blocked: small pieces are joined and large
+ones sliced (without copying) into blocksize blocks, so the output chunks
+have the best size whatever the pieces look like, and about one block of
+input is held at a time (and one block of output, for the framing format).
+The raw format is the exception: it is a single buffer, built from the
+whole input.
+"""
+from __future__ import absolute_import
+
+from .snappy import (
+    _STREAM_TO_STREAM_BLOCK_SIZE, compress, uncompress,
+    HadoopStreamCompressor, HadoopStreamDecompressor, StreamCompressor,
+    StreamDecompressor
+)
+from .snappy_formats import _SNIFF_SIZE, sniff_format
+
+
+def _split_blocks(pending, buf, blocksize):
+    """Yield the blocksize blocks completed by the piece buf, the bytes
+    left over being kept in pending, a bytearray carried from one piece to
+    the next. Blocks may be memoryviews of buf, valid until the next block
+    is requested.
+    """
+    view = memoryview(buf).cast("B")
+    if pending:
+        take = blocksize - len(pending)
+        pending += view[:take]
+        view = view[take:]
+        if len(pending) < blocksize:
+            return
+        yield bytes(pending)
+        del pending[:]
+    while len(view) >= blocksize:
+        yield view[:blocksize]
+        view = view[blocksize:]
+    pending += view
+
+
+def _iter_blocks(iterable, blocksize):
+    """Re-block the pieces of iterable into blocksize pieces, see
+    _split_blocks.
+    """
+    pending = bytearray()
+    for buf in iterable:
+        yield from _split_blocks(pending, buf, blocksize)
+    if pending:
+        yield bytes(pending)
+
+
+def iter_compress(iterable,
+                  format="framing",
+                  blocksize=_STREAM_TO_STREAM_BLOCK_SIZE,
+                  adaptive=False):
+    """Yield the compressed form of the bytes-like pieces of iterable, one
+    chunk (framing) or block (hadoop) per blocksize bytes of input.
+
+    :param format: "framing", "hadoop" or "raw"
+    :param adaptive: store incompressible data uncompressed, see
+        StreamCompressor and HadoopStreamCompressor
+    """
+    if format == "raw":
+        data = b"".join(iterable)
+        yield compress(data)
+        return
+    if format == "framing":
+        compressor = StreamCompressor(adaptive=adaptive)
+    elif format == "hadoop":
+        compressor = HadoopStreamCompressor(adaptive=adaptive)
+    else:
+        raise ValueError("Unknown format: {!r}".format(format))
+    for block in _iter_blocks(iterable, blocksize):
+        buf = compressor.add_chunk(block)
+        if buf: yield buf
+    buf = compressor.flush()
+    if buf: yield buf
+
+
+def _sniffed(iterable):
+    """Detect the format from the first pieces of iterable. Returns it
+    and an iterator over all the pieces, including those read to detect it.
+    """
+    iterator = iter(iterable)
+    prefix = bytearray()
+    complete = False
+    while len(prefix) < _SNIFF_SIZE:
+        buf = next(iterator, None)
+        if buf is None:
+            complete = True
+            break
+        prefix += buf
+    form, _ = sniff_format(bytes(prefix), complete=complete)
+
+    def pieces():
+        yield prefix
+        yield from iterator
+    return form, pieces()
+
+
+def iter_decompress(iterable,
+                    format="framing",
+                    blocksize=_STREAM_TO_STREAM_BLOCK_SIZE,
+                    max_output_size=None):
+    """Yield the uncompressed data of the compressed stream made of the
+    bytes-like pieces of iterable.
+
+    Pieces are decoded blocksize bytes at a time; for the framing format
+    the output is also yielded in pieces of at most blocksize bytes.
+
+    :param format: "framing", "hadoop", "raw", or "auto" to detect it from
+        the first bytes
+    :param max_output_size: raise UncompressError instead of yielding more
+        than this many bytes in total
+    """
+    if format == "auto":
+        format, iterable = _sniffed(iterable)
+    if format == "raw":
+        data = b"".join(iterable)
+        yield uncompress(data, max_output_size=max_output_size)
+        return
+    if format == "framing":
+        decompressor = StreamDecompressor(max_output_size=max_output_size)
+        for block in _iter_blocks(iterable, blocksize):
+            buf = decompressor.decompress(block, blocksize)
+            while buf:
+                yield buf
+                if decompressor.needs_input:
+                    break
+                buf = decompressor.decompress(b"", blocksize)
+    elif format == "hadoop":
+        decompressor = HadoopStreamDecompressor(
+            max_output_size=max_output_size)
+        for block in _iter_blocks(iterable, blocksize):
+            buf = decompressor.decompress(block)
+            if buf: yield buf
+    else:
+        raise ValueError("Unknown format: {!r}".format(format))
+    # makes sure the stream ended well
+    buf = decompressor.flush()
+    if buf: yield buf
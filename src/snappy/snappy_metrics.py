@@ -0,0 +1,255 @@
+"""Opt-in metrics of compression and decompression.
+
+enable_metrics - starts recording every call into a sink
+disable_metrics - stops recording
+Metrics - sink keeping counters and latency histograms in memory, with a
+    Prometheus text exporter
+
+Once enabled, compress and uncompress with their _into and _many variants
+(format "raw"), the methods of the stream compressors and decompressors
+(formats "framing" and "hadoop"), the stream functions and transcode (by
+output format) each report one observation per call to the sink:
+
+    sink(operation, format, bytes_in, bytes_out, seconds, error)
+
+operation is "compress", "decompress", "stream_compress",
+"stream_decompress" or "transcode", and error is None, or the cause of the
+exception the call raised (see error_cause). Only the outermost call is
+reported, so that the bytes of stream_compress are not counted again by the
+StreamCompressor it uses.
+
+While disabled, the instrumented functions only test a global for None.
+"""
+from __future__ import absolute_import
+
+import bisect
+import threading
+import time
+
+import cramjam
+
+from . import snappy as _snappy
+from .snappy import UncompressError
+from .snappy_formats import _Counter
+
+# upper bounds of the latency histogram buckets, in seconds
+DEFAULT_BUCKETS = (1e-5, 1e-4, 1e-3, 1e-2, 0.1, 1.0, 10.0)
+
+
+def error_cause(err):
+    """Short name of what went wrong, used to count errors by cause:
+    "checksum", "corrupt" (invalid compressed data), "output_limit"
+    (max_output_size exceeded), "truncated" (a stream ending inside a block),
+    "format" (any other invalid input), or the exception class name for
+    anything but UncompressError.
+    """
+    if not isinstance(err, UncompressError):
+        return type(err).__name__
+    if isinstance(err.__cause__, cramjam.DecompressionError):
+        if "checksum" in str(err.__cause__):
+            return "checksum"
+        return "corrupt"
+    message = str(err)
+    if "max_output_size" in message:
+        return "output_limit"
+    if "ended inside" in message:
+        return "truncated"
+    return "format"
+
+
+def _nbytes(data):
+    """Size of a buffer, of a list of buffers (the messages of the batch
+    functions), or of a packed (buffer, offsets) result; ints, returned by
+    the *_into functions, are sizes already.
+    """
+    if data is None:
+        return 0
+    if isinstance(data, int):
+        return data
+    if isinstance(data, tuple):
+        data = data[0]
+    if isinstance(data, list):
+        return sum(map(_nbytes, data))
+    return memoryview(data).nbytes
+
+
+class _Recorder():
+    """Times instrumented calls and reports them to sink. Calls made while
+    another one is being recorded in the same thread are not reported.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self._local = threading.local()
+
+    @property
+    def busy(self):
+        return getattr(self._local, "busy", False)
+
+    def call(self, operation, format, data, func, *args, **kwargs):
+        """Record func(*args, **kwargs), data being its input buffer (or
+        list of buffers, see _nbytes).
+        """
+        local = self._local
+        local.busy = True
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as err:
+            self.sink(operation, format, _nbytes(data), 0,
+                      time.perf_counter() - start, error_cause(err))
+            raise
+        finally:
+            local.busy = False
+        self.sink(operation, format, _nbytes(data), _nbytes(result),
+                  time.perf_counter() - start, None)
+        return result
+
+    def stream(self, operation, format, func, src, dst, *args, **kwargs):
+        """Record func(src, dst, *args, **kwargs), counting the bytes read
+        from src (and given as start_chunk) and written to dst.
+        """
+        src, dst = _Counter(src), _Counter(dst)
+        local = self._local
+        local.busy = True
+        error = None
+        start = time.perf_counter()
+        try:
+            return func(src, dst, *args, **kwargs)
+        except Exception as err:
+            error = error_cause(err)
+            raise
+        finally:
+            local.busy = False
+            bytes_in = src.count + _nbytes(kwargs.get("start_chunk"))
+            self.sink(operation, format, bytes_in, dst.count,
+                      time.perf_counter() - start, error)
+
+
+def enable_metrics(sink=None):
+    """Start reporting calls to sink, a callable taking (operation, format,
+    bytes_in, bytes_out, seconds, error), such as a Metrics instance, which
+    is created when sink is None. Returns the sink.
+
+    Replaces the sink of a previous call; there is one per process.
+    """
+    if sink is None:
+        sink = Metrics()
+    _snappy._recorder = _Recorder(sink)
+    return sink
+
+
+def disable_metrics():
+    """Stop reporting calls."""
+    _snappy._recorder = None
+
+
+class Metrics():
+
+    """In-memory sink for enable_metrics, counting per operation and format
+    the calls, bytes in and out, errors by cause and the call latencies in a
+    histogram with the given bucket bounds (in seconds).
+
+        metrics = snappy.enable_metrics()
+        ...
+        metrics.snapshot()[("compress", "raw")]["ratio"]
+
+    prometheus returns the counters in the Prometheus text format, to be
+    served from an HTTP endpoint.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, operation, format, bytes_in, bytes_out, seconds,
+                 error):
+        key = (operation, format)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {
+                    "calls": 0, "bytes_in": 0, "bytes_out": 0,
+                    "seconds": 0.0, "errors": {},
+                    # one count per bucket, the last one above all bounds
+                    "latency": [0] * (len(self.buckets) + 1),
+                }
+            series["calls"] += 1
+            series["bytes_in"] += bytes_in
+            series["bytes_out"] += bytes_out
+            series["seconds"] += seconds
+            series["latency"][bisect.bisect_left(self.buckets, seconds)] += 1
+            if error is not None:
+                errors = series["errors"]
+                errors[error] = errors.get(error, 0) + 1
+
+    def snapshot(self):
+        """Copy of the counters by (operation, format). Each holds calls,
+        bytes_in, bytes_out, seconds (in total), errors (a dict by cause),
+        latency (counts per bucket, the last one for slower calls) and
+        ratio, compressed bytes over uncompressed bytes.
+        """
+        with self._lock:
+            result = {}
+            for (operation, format), series in self._series.items():
+                series = dict(series, errors=dict(series["errors"]),
+                              latency=list(series["latency"]))
+                plain, packed = series["bytes_in"], series["bytes_out"]
+                if operation.endswith("decompress"):
+                    plain, packed = packed, plain
+                series["ratio"] = packed / plain if plain else 1.0
+                result[operation, format] = series
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def prometheus(self, prefix="snappy"):
+        """The counters in the Prometheus text exposition format."""
+        snapshot = sorted(self.snapshot().items())
+        lines = []
+
+        def metric(name, kind, text):
+            lines.append("# HELP {}_{} {}".format(prefix, name, text))
+            lines.append("# TYPE {}_{} {}".format(prefix, name, kind))
+
+        def sample(name, labels, value):
+            lines.append("{}_{}{{{}}} {}".format(
+                prefix, name,
+                ",".join('{}="{}"'.format(*label) for label in labels),
+                value))
+
+        for name, text in (("calls", "Calls made."),
+                           ("bytes_in", "Bytes taken as input."),
+                           ("bytes_out", "Bytes returned or written.")):
+            metric(name + "_total", "counter", text)
+            for (operation, format), series in snapshot:
+                sample(name + "_total",
+                       (("operation", operation), ("format", format)),
+                       series[name])
+        metric("errors_total", "counter", "Calls that raised, by cause.")
+        for (operation, format), series in snapshot:
+            for cause, count in sorted(series["errors"].items()):
+                sample("errors_total", (("operation", operation),
+                                        ("format", format),
+                                        ("cause", cause)), count)
+        metric("compression_ratio", "gauge",
+               "Compressed bytes over uncompressed bytes.")
+        for (operation, format), series in snapshot:
+            sample("compression_ratio",
+                   (("operation", operation), ("format", format)),
+                   series["ratio"])
+        metric("duration_seconds", "histogram", "Call latency.")
+        for (operation, format), series in snapshot:
+            labels = (("operation", operation), ("format", format))
+            count = 0
+            bounds = [repr(float(b)) for b in self.buckets] + ["+Inf"]
+            for bound, bucket in zip(bounds, series["latency"]):
+                count += bucket
+                sample("duration_seconds_bucket", labels + (("le", bound),),
+                       count)
+            sample("duration_seconds_sum", labels, series["seconds"])
+            sample("duration_seconds_count", labels, series["calls"])
+        return "\n".join(lines) + "\n"
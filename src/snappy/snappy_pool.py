@@ -0,0 +1,155 @@
+"""Reuse of compressors, decompressors and output buffers in hot loops.
+
+ContextPool - thread-safe pool of stream compressors or decompressors, reset
+    when they are returned
+BufferPool - bounded pool of output buffers by size class, with compress and
+    uncompress methods writing into them
+
+Both count hits (requests served from the pool) and misses (requests that
+had to create a new object), see their stats methods.
+
+snappy.compress and snappy.uncompress take a BufferPool as their pool
+argument. The stream classes are pooled as a whole with ContextPool, which
+reuses them across streams through reset; their output is not drawn from a
+BufferPool.
+"""
+from __future__ import absolute_import
+
+import collections
+import contextlib
+import threading
+
+from .snappy import (
+    compress_into, decompress_into, max_compressed_length,
+    uncompressed_length, _check_output_size
+)
+
+
+class ContextPool():
+
+    """Pool of objects made by factory, such as StreamDecompressor or
+    functools.partial(StreamCompressor, adaptive=True).
+
+    acquire returns an idle object, or a new one when there is none; release
+    calls its reset method and keeps it for the next acquire, unless maxsize
+    objects are idle already. borrow wraps both in a with statement:
+
+        pool = ContextPool(snappy.StreamDecompressor)
+        with pool.borrow() as decompressor:
+            data = decompressor.decompress(compressed)
+    """
+
+    def __init__(self, factory, maxsize=16):
+        self.factory = factory
+        self.maxsize = maxsize
+        self._idle = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                self.hits += 1
+                return self._idle.pop()
+            self.misses += 1
+        return self.factory()
+
+    def release(self, context):
+        context.reset()
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append(context)
+
+    @contextlib.contextmanager
+    def borrow(self):
+        """Acquire an object for the duration of a with block. It is only
+        returned to the pool if the block does not raise, since the stream
+        it was working on may have been left in any state.
+        """
+        context = self.acquire()
+        yield context
+        self.release(context)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "idle": len(self._idle)}
+
+
+class BufferPool():
+
+    """Pool of bytearrays whose sizes are powers of two (the size classes),
+    holding at most max_per_class idle buffers of each size. Requests larger
+    than max_size are served with new buffers that are never pooled.
+
+    compress and uncompress write into a pooled buffer and return a
+    memoryview of the result, which must be given back with release once it
+    is no longer used; the buffer is handed out again after that.
+    """
+
+    def __init__(self, max_per_class=8, min_size=4096, max_size=2**26):
+        self.max_per_class = max_per_class
+        self.min_size = min_size
+        self.max_size = max_size
+        self._idle = collections.defaultdict(list)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # buffers released while their class was full
+        self.dropped = 0
+
+    def _size_class(self, size):
+        return max(self.min_size, 1 << max(size - 1, 0).bit_length())
+
+    def acquire(self, size):
+        """Return a bytearray of at least size bytes."""
+        if size > self.max_size:
+            with self._lock:
+                self.misses += 1
+            return bytearray(size)
+        size_class = self._size_class(size)
+        with self._lock:
+            idle = self._idle[size_class]
+            if idle:
+                self.hits += 1
+                return idle.pop()
+            self.misses += 1
+        return bytearray(size_class)
+
+    def release(self, buf):
+        """Return a buffer from acquire, or a memoryview from compress or
+        uncompress, to the pool.
+        """
+        if isinstance(buf, memoryview):
+            view, buf = buf, buf.obj
+            view.release()
+        size = len(buf)
+        if size > self.max_size or size != self._size_class(size):
+            return
+        with self._lock:
+            idle = self._idle[size]
+            if len(idle) < self.max_per_class:
+                idle.append(buf)
+            else:
+                self.dropped += 1
+
+    def compress(self, data):
+        """Like snappy.compress, but into a pooled buffer."""
+        buf = self.acquire(max_compressed_length(data))
+        return memoryview(buf)[:compress_into(data, buf)]
+
+    def uncompress(self, data, max_output_size=None):
+        """Like snappy.uncompress, but into a pooled buffer."""
+        size = uncompressed_length(data)
+        _check_output_size(size, max_output_size)
+        buf = self.acquire(size)
+        return memoryview(buf)[:decompress_into(data, buf)]
+
+    decompress = uncompress
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "dropped": self.dropped,
+                    "idle": sum(map(len, self._idle.values()))}
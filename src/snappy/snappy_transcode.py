@@ -0,0 +1,250 @@
+"""Conversion between the framing, hadoop and raw formats.
+
+transcode - rewrites a compressed stream in another format, block by block
+
+All three formats carry raw snappy buffers, so most conversions reuse the
+compressed data as is and only rewrite the framing around it:
+
+- framing to hadoop: every compressed chunk becomes a block holding its
+  payload; uncompressed chunks become a block holding a single literal
+- hadoop to framing: every sub-block of at most 64 KiB (the framing chunk
+  limit) becomes a compressed chunk. The chunk needs the CRC-32C of the
+  uncompressed data, so the sub-block is decompressed, but not compressed
+  again
+- raw to hadoop: the buffer becomes a single block, if it is not larger
+  than blocksize
+
+Everything else is decompressed and compressed again, one block at a time
+except for raw output, which is a single buffer. Without a native CRC-32C
+(see snappy_crc32c) checksumming in Python is slower than compressing, so
+hadoop to framing conversions also compress again.
+"""
+from __future__ import absolute_import
+
+import shutil
+
+from . import snappy as _snappy
+from .snappy import (
+    _CHUNK_MAX, _FAST_CRC32C, _STREAM_HEADER_BLOCK,
+    _STREAM_TO_STREAM_BLOCK_SIZE, _compress_frame_block,
+    _decompress_frame_chunks, _frame_chunk, _literal_block, _uncompress_len,
+    compress, uncompress, HadoopStreamCompressor, UncompressError
+)
+from .snappy_crc32c import masked_crc32c
+from .snappy_formats import detect_format
+
+_COMPRESSED_CHUNK = 0x00
+_UNCOMPRESSED_CHUNK = 0x01
+_IDENTIFIER_CHUNK = 0xff
+
+
+class _Block():
+    """A piece of the stream: either payload, a raw snappy buffer, or plain
+    uncompressed data, with the masked CRC-32C of the data if known.
+    """
+    __slots__ = ("payload", "plain", "crc")
+
+    def __init__(self, payload=None, plain=None, crc=None):
+        self.payload = payload
+        self.plain = plain
+        self.crc = crc
+
+    @property
+    def size(self):
+        if self.plain is not None:
+            return len(self.plain)
+        return _payload_length(self.payload)
+
+    def data(self):
+        if self.plain is None:
+            self.plain = uncompress(self.payload)
+        return self.plain
+
+
+def _payload_length(payload):
+    try:
+        return _uncompress_len(payload)
+    except Exception as err:
+        raise UncompressError("Invalid snappy block") from err
+
+
+class _Prefixed():
+    """Reader returning the bytes already read from src before the rest."""
+
+    def __init__(self, prefix, src):
+        self.prefix = prefix
+        self.src = src
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.src.read(size)
+        if size is None or size < 0:
+            buf, self.prefix = self.prefix + self.src.read(), b""
+            return buf
+        buf, self.prefix = self.prefix[:size], self.prefix[size:]
+        return buf
+
+
+def _read_exact(src, size, what):
+    chunks = []
+    remaining = size
+    while remaining:
+        buf = src.read(remaining)
+        if not buf:
+            raise UncompressError("Stream ended inside a {}".format(what))
+        chunks.append(buf)
+        remaining -= len(buf)
+    return b"".join(chunks)
+
+
+def _read_framing(src, verify):
+    header = src.read(len(_STREAM_HEADER_BLOCK))
+    if header and header != _STREAM_HEADER_BLOCK:
+        raise UncompressError("Not a framed snappy stream")
+    while True:
+        header = src.read(4)
+        if not header:
+            return
+        if len(header) < 4:
+            header += _read_exact(src, 4 - len(header), "chunk header")
+        chunk_type = header[0]
+        body = _read_exact(src, int.from_bytes(header[1:4], "little"),
+                           "chunk")
+        if chunk_type in (_COMPRESSED_CHUNK, _UNCOMPRESSED_CHUNK):
+            if len(body) < 4:
+                raise UncompressError("Chunk too short for its checksum")
+            plain = None
+            if verify:
+                # cramjam checks the CRC-32C while decoding
+                plain = _decompress_frame_chunks(header + body)
+            if chunk_type == _COMPRESSED_CHUNK:
+                yield _Block(payload=body[4:], plain=plain, crc=body[:4])
+            else:
+                yield _Block(plain=body[4:], crc=body[:4])
+        elif chunk_type == _IDENTIFIER_CHUNK:
+            if header + body != _STREAM_HEADER_BLOCK:
+                raise UncompressError("Invalid stream identifier chunk")
+        elif chunk_type < 0x80:
+            raise UncompressError(
+                "Unskippable chunk type %#x" % chunk_type)
+
+
+def _read_hadoop(src, verify):
+    while True:
+        header = src.read(4)
+        if not header:
+            return
+        if len(header) < 4:
+            header += _read_exact(src, 4 - len(header), "block header")
+        remaining = int.from_bytes(header, "big")
+        while remaining:
+            length = int.from_bytes(_read_exact(src, 4, "block header"),
+                                    "big")
+            block = _Block(payload=_read_exact(src, length, "block"))
+            size = block.size
+            if size > remaining:
+                raise UncompressError(
+                    "Sub-block decompresses past the end of its block")
+            remaining -= size
+            yield block
+
+
+def _read_raw(src, verify):
+    data = src.read()
+    yield _Block(payload=data)
+
+
+def _write_framing(blocks, dst, blocksize):
+    dst.write(_STREAM_HEADER_BLOCK)
+    for block in blocks:
+        if block.payload is None:
+            if block.crc is None:
+                dst.write(_compress_frame_block(block.plain))
+            else:
+                dst.write(_frame_chunk(_UNCOMPRESSED_CHUNK, block.crc,
+                                       block.plain))
+            continue
+        if block.size > _CHUNK_MAX or (block.crc is None and
+                                       not _FAST_CRC32C):
+            data = block.data()
+            for start in range(0, len(data), blocksize):
+                dst.write(_compress_frame_block(data[start:start + blocksize]))
+            continue
+        crc = block.crc
+        if crc is None:
+            crc = masked_crc32c(block.data()).to_bytes(4, "little")
+        dst.write(_frame_chunk(_COMPRESSED_CHUNK, crc, block.payload))
+
+
+def _write_hadoop(blocks, dst, blocksize):
+    compressor = HadoopStreamCompressor()
+    for block in blocks:
+        size = block.size
+        if not size:
+            continue
+        if block.payload is None:
+            payload = _literal_block(block.plain)
+        elif size <= max(blocksize, _CHUNK_MAX):
+            payload = block.payload
+        else:
+            data = block.data()
+            for start in range(0, len(data), blocksize):
+                dst.write(compressor.add_chunk(data[start:start + blocksize]))
+            continue
+        dst.write(b"".join((size.to_bytes(4, "big"),
+                            len(payload).to_bytes(4, "big"), payload)))
+
+
+def _write_raw(blocks, dst, blocksize):
+    blocks = [block for block in blocks if block.size]
+    if len(blocks) == 1 and blocks[0].payload is not None:
+        dst.write(blocks[0].payload)
+    else:
+        dst.write(compress(b"".join(block.data() for block in blocks)))
+
+
+_READERS = {
+    "framing": _read_framing,
+    "hadoop": _read_hadoop,
+    "raw": _read_raw,
+}
+
+_WRITERS = {
+    "framing": _write_framing,
+    "hadoop": _write_hadoop,
+    "raw": _write_raw,
+}
+
+
+def transcode(src, dst, from_format="auto", to_format="framing",
+              blocksize=_STREAM_TO_STREAM_BLOCK_SIZE, verify=True):
+    """Reads a compressed stream in from_format from src and writes it to dst
+    in to_format, reusing the compressed data where the formats allow it
+    (see the module documentation).
+
+    :param from_format: "framing", "hadoop", "raw", or "auto" to detect it
+        from the first bytes of src
+    :param to_format: "framing", "hadoop" or "raw"
+    :param blocksize: size of the blocks written when data has to be
+        compressed again; for hadoop output also the largest block whose
+        payload is reused, though framing chunks always are
+    :param verify: check the CRC-32C of framing chunks, which takes
+        decompressing them. Other formats have no checksums; their blocks
+        are decoded only when needed
+    """
+    recorder = _snappy._recorder
+    if recorder is not None and not recorder.busy:
+        return recorder.stream("transcode", to_format, transcode, src, dst,
+                               from_format, to_format, blocksize, verify)
+    if to_format not in _WRITERS:
+        raise ValueError("Unknown format: {!r}".format(to_format))
+    if from_format == "auto":
+        from_format, _, prefix = detect_format(src)
+        src = _Prefixed(prefix, src)
+    elif from_format not in _READERS:
+        raise ValueError("Unknown format: {!r}".format(from_format))
+    if from_format == to_format and not verify:
+        shutil.copyfileobj(src, dst, blocksize)
+        return
+    blocks = _READERS[from_format](src, verify)
+    _WRITERS[to_format](blocks, dst, blocksize)
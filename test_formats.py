@@ -1,7 +1,11 @@
 import io
 import os
+import subprocess
+import sys
+import tempfile
 from unittest import TestCase
 
+import snappy
 from snappy import snappy_formats as formats
 
 
@@ -72,6 +76,193 @@ class TestFormatRawAuto(TestFormatBase):
     success = True
 
 
+class TestFileFunctions(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def roundtrip(self, data, compress_format, decompress_format="auto"):
+        with open(self.path("in"), "wb") as f:
+            f.write(data)
+        formats.compress_file(self.path("in"), self.path("packed"),
+                              format=compress_format)
+        formats.decompress_file(self.path("packed"), self.path("out"),
+                                format=decompress_format)
+        with open(self.path("out"), "rb") as f:
+            self.assertEqual(f.read(), data)
+        with open(self.path("packed"), "rb") as f:
+            return f.read()
+
+    def test_formats(self):
+        data = os.urandom(1024 * 256) + b"snappy" * 100000
+        for form in ("framing", "hadoop", "raw"):
+            packed = self.roundtrip(data, form, form)
+            compress_func = formats.get_compress_function(form)
+            expected = io.BytesIO()
+            compress_func(io.BytesIO(data), expected)
+            self.assertEqual(packed, expected.getvalue())
+        self.roundtrip(data, "auto")
+        self.roundtrip(os.urandom(1024), "raw")
+        for form in ("hadoop", "raw"):
+            self.roundtrip(b"snappy" * 100000, form)
+
+    def test_empty(self):
+        for form in ("framing", "hadoop", "raw"):
+            self.roundtrip(b"", form, form)
+
+
+class _Pipe(io.RawIOBase):
+    """Non-seekable stream returning at most 7 bytes per read, like a pipe
+    delivering its data in small pieces.
+    """
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        buf = self.data.read(min(len(b), 7))
+        b[:len(buf)] = buf
+        return len(buf)
+
+
+class TestDetectFormat(TestCase):
+    data = b"compressible " * 20000
+
+    def compressed(self, form):
+        out = io.BytesIO()
+        formats.get_compress_function(form)(io.BytesIO(self.data), out)
+        return out.getvalue()
+
+    def test_detect_non_seekable(self):
+        for form in ("framing", "hadoop", "raw"):
+            fin = _Pipe(self.compressed(form))
+            detected, confidence, prefix = formats.detect_format(fin)
+            self.assertEqual(detected, form)
+            self.assertGreater(confidence, 0)
+            self.assertEqual(len(prefix), formats._SNIFF_SIZE)
+            out = io.BytesIO()
+            formats.get_decompress_function(detected, fin)(
+                fin, out, start_chunk=prefix)
+            self.assertEqual(out.getvalue(), self.data)
+
+    def test_confidence(self):
+        self.assertEqual(
+            formats.sniff_format(self.compressed("framing")[:64]),
+            ("framing", 1.0))
+        hadoop = formats.sniff_format(self.compressed("hadoop")[:64])
+        raw = formats.sniff_format(self.compressed("raw")[:64])
+        self.assertEqual(hadoop[0], "hadoop")
+        self.assertEqual(raw[0], "raw")
+        self.assertGreater(hadoop[1], raw[1])
+
+    def test_complete_input_is_verified(self):
+        for form in ("hadoop", "raw"):
+            out = io.BytesIO()
+            formats.get_compress_function(form)(io.BytesIO(b"short"), out)
+            self.assertEqual(formats.sniff_format(out.getvalue(), True),
+                             (form, 1.0))
+
+    def test_unknown_format(self):
+        for data in (b"", b"not snappy at all", b"\x00" * 64):
+            with self.assertRaises(formats.UncompressError):
+                formats.detect_format(io.BytesIO(data))
+
+    def test_guess_rewinds(self):
+        fin = io.BytesIO(self.compressed("hadoop"))
+        form, func = formats.guess_format_by_header(fin)
+        self.assertEqual(form, "hadoop")
+        self.assertEqual(fin.tell(), 0)
+
+    def test_cli_stdin(self):
+        for form in ("framing", "hadoop", "raw"):
+            result = subprocess.run(
+                [sys.executable, "-m", "snappy", "-d"],
+                input=self.compressed(form), stdout=subprocess.PIPE,
+                check=True)
+            self.assertEqual(result.stdout, self.data)
+
+
+class TestCommandLine(TestCase):
+    data = b"command line " * 50000
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def path(self, *names):
+        return os.path.join(self.tmpdir.name, *names)
+
+    def snappy(self, *args):
+        return subprocess.run([sys.executable, "-m", "snappy"] + list(args),
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              check=True)
+
+    def test_formats_and_options(self):
+        with open(self.path("in"), "wb") as f:
+            f.write(self.data)
+        for form in ("framing", "hadoop", "raw"):
+            self.snappy("-c", "--format", form, "-T", "2", "-b", "16K",
+                        self.path("in"), self.path("packed"))
+            with open(self.path("packed"), "rb") as f:
+                self.assertEqual(formats.detect_format(f)[0], form)
+            result = self.snappy("-d", "-v", "-T", "0", self.path("packed"))
+            self.assertEqual(result.stdout, self.data)
+            self.assertIn(b"MB/s", result.stderr)
+            self.assertIn(b"ratio", result.stderr)
+
+    def test_hadoop_blocks(self):
+        with open(self.path("in"), "wb") as f:
+            f.write(self.data)
+        self.snappy("-c", "-t", "hadoop", "-T", "2", "-b", "256K",
+                    "--sub-block-size", "100K", self.path("in"),
+                    self.path("packed"))
+        with open(self.path("packed"), "rb") as f:
+            packed = f.read()
+        self.assertEqual(int.from_bytes(packed[:4], "big"), 256 * 1024)
+        result = self.snappy("-d", self.path("packed"))
+        self.assertEqual(result.stdout, self.data)
+
+    def test_batch(self):
+        os.makedirs(self.path("src", "sub"))
+        files = {"a": self.data, os.path.join("sub", "b"): os.urandom(1000)}
+        for name, data in files.items():
+            with open(self.path("src", name), "wb") as f:
+                f.write(data)
+        self.snappy("-c", "-B", self.path("src"), "-o", self.path("packed"))
+        self.snappy("-d", "-B", "--rm", self.path("packed"))
+        for name, data in files.items():
+            self.assertFalse(os.path.exists(self.path("packed", name + ".sz")))
+            with open(self.path("packed", name), "rb") as f:
+                self.assertEqual(f.read(), data)
+        # existing outputs are only overwritten with -f
+        args = ["-c", "-B", self.path("src", "a"), "-o", self.path("packed")]
+        self.snappy(*args)
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.snappy(*args)
+        self.snappy("-f", *args)
+
+    def test_transcode(self):
+        os.makedirs(self.path("src"))
+        with open(self.path("src", "a.sz"), "wb") as f:
+            f.write(snappy.HadoopStreamCompressor().add_chunk(self.data))
+        # files without the suffix are left alone
+        with open(self.path("src", "a"), "wb") as f:
+            f.write(self.data)
+        self.snappy("-x", "framing", "-t", "hadoop", "-B", self.path("src"),
+                    "-o", self.path("out"))
+        self.assertEqual(os.listdir(self.path("out")), ["a.sz"])
+        with open(self.path("out", "a.sz"), "rb") as f:
+            self.assertEqual(formats.detect_format(f)[0], "framing")
+        result = self.snappy("-x", "raw", self.path("out", "a.sz"))
+        self.assertEqual(snappy.uncompress(result.stdout), self.data)
+
+
 if __name__ == "__main__":
     import unittest
     unittest.main()
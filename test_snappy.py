@@ -26,12 +26,26 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 
+import array
+import asyncio
+import concurrent.futures
+import io
 import os
 import platform
 import sys
 import random
+import subprocess
+import tempfile
+import time
+import zlib
+import cramjam
 import snappy
-from unittest import TestCase
+from unittest import TestCase, mock, skipIf
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class SnappyModuleTest(TestCase):
@@ -42,6 +56,31 @@ class SnappyModuleTest(TestCase):
             version_line, = (l for l in f.read().splitlines() if l.startswith("version"))
         assert version_line.split("=")[1].strip(" '\"") == snappy.__version__
 
+    def test_lazy_import(self):
+        # the codec and optional dependencies load on first use only
+        code = (
+            "import sys, snappy\n"
+            "assert 'cramjam' not in sys.modules\n"
+            "assert 'asyncio' not in sys.modules\n"
+            "assert snappy.uncompress(snappy.compress(b'abc')) == b'abc'\n"
+            "assert 'cramjam' in sys.modules\n"
+            "assert 'asyncio' not in sys.modules\n"
+        )
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            [os.path.dirname(os.path.dirname(snappy.__file__))] +
+            env.get("PYTHONPATH", "").split(os.pathsep))
+        subprocess.run([sys.executable, "-c", code], env=env, check=True)
+
+    def test_exports(self):
+        for name in snappy.__all__:
+            self.assertIn(name, dir(snappy))
+            self.assertIsNotNone(getattr(snappy, name))
+        self.assertIs(snappy.snappy_formats.compress_file,
+                      snappy.compress_file)
+        with self.assertRaises(AttributeError):
+            snappy.no_such_name
+
 
 class SnappyCompressionTest(TestCase):
     def test_simple_compress(self):
@@ -95,6 +134,116 @@ class SnappyCompressionTest(TestCase):
             self.assertEqual(actual, expected)
 
 
+class SnappyOutputLimitTest(TestCase):
+
+    def setUp(self):
+        self.data = b"snappy" * 100000
+
+    def test_uncompress(self):
+        compressed = snappy.compress(self.data)
+        self.assertEqual(snappy.uncompress(compressed,
+                                           max_output_size=len(self.data)),
+                         self.data)
+        self.assertRaises(snappy.UncompressError, snappy.uncompress,
+                          compressed, max_output_size=len(self.data) - 1)
+        # the preamble alone claims 4 GB
+        bomb = b"\xff\xff\xff\xff\x0f" + compressed[4:]
+        self.assertRaises(snappy.UncompressError, snappy.uncompress,
+                          bomb, max_output_size=2**20)
+
+    def test_streams(self):
+        for compressor, decompressor_cls, stream_decompress in (
+                (snappy.StreamCompressor(), snappy.StreamDecompressor,
+                 snappy.stream_decompress),
+                (snappy.HadoopStreamCompressor(),
+                 snappy.HadoopStreamDecompressor,
+                 snappy.snappy.hadoop_stream_decompress)):
+            compressed = compressor.add_chunk(self.data)
+            limit = len(self.data) - 1000
+            decompressor = decompressor_cls(max_output_size=limit)
+            self.assertRaises(snappy.UncompressError,
+                              decompressor.decompress, compressed)
+            self.assertRaises(snappy.UncompressError, stream_decompress,
+                              io.BytesIO(compressed), io.BytesIO(),
+                              max_output_size=limit)
+            dst = io.BytesIO()
+            stream_decompress(io.BytesIO(compressed), dst,
+                              max_output_size=len(self.data))
+            self.assertEqual(dst.getvalue(), self.data)
+
+    def test_raw_stream(self):
+        compressed = io.BytesIO(snappy.compress(self.data))
+        self.assertRaises(snappy.UncompressError,
+                          snappy.snappy.raw_stream_decompress,
+                          compressed, io.BytesIO(), max_output_size=100)
+
+
+class SnappyIntoBufferTest(TestCase):
+
+    def test_compress_into(self):
+        data = b"snappy +" * 1000
+        out = bytearray(snappy.max_compressed_length(data))
+        written = snappy.compress_into(data, out)
+        self.assertEqual(bytes(out[:written]), snappy.compress(data))
+        self.assertEqual(snappy.uncompressed_length(out[:written]),
+                         len(data))
+
+    def test_decompress_into_memoryview(self):
+        data = os.urandom(5000) + b"a" * 5000
+        compressed = snappy.compress(data)
+        out = memoryview(bytearray(20000))[100:]
+        written = snappy.decompress_into(compressed, out)
+        self.assertEqual(written, len(data))
+        self.assertEqual(bytes(out[:written]), data)
+
+    def test_max_compressed_length(self):
+        self.assertEqual(snappy.max_compressed_length(600), 732)
+        self.assertEqual(snappy.max_compressed_length(b"x" * 600), 732)
+
+    def test_small_buffers(self):
+        data = b"hello world!" * 10
+        self.assertRaises(ValueError, snappy.compress_into,
+                          data, bytearray(len(data)))
+        self.assertRaises(snappy.UncompressError, snappy.decompress_into,
+                          snappy.compress(data), bytearray(10))
+        self.assertRaises(snappy.UncompressError,
+                          snappy.uncompressed_length, b"\xff")
+
+
+class SnappyBatchTest(TestCase):
+
+    def setUp(self):
+        self.messages = [os.urandom(random.randint(0, 50)) * 20
+                         for _ in range(200)]
+
+    def test_list(self):
+        compressed = snappy.compress_many(self.messages)
+        self.assertEqual(compressed,
+                         [snappy.compress(m) for m in self.messages])
+        self.assertEqual(snappy.decompress_many(compressed), self.messages)
+
+    def test_packed(self):
+        buf, offsets = snappy.compress_many(self.messages, packed=True)
+        self.assertEqual(len(offsets), len(self.messages) + 1)
+        self.assertEqual(snappy.decompress_many(buf, offsets),
+                         self.messages)
+        out, out_offsets = snappy.decompress_many(buf, offsets, packed=True)
+        self.assertEqual(out, b"".join(self.messages))
+        self.assertEqual(snappy.compress_many(out, out_offsets, packed=True),
+                         (buf, offsets))
+
+    def test_error(self):
+        self.assertRaises(snappy.UncompressError, snappy.decompress_many,
+                          [snappy.compress(b"hello"), b"hoa"], packed=True)
+
+    def test_packed_wide_items(self):
+        # len() of these is a quarter of their size in bytes
+        arrays = [array.array("i", os.urandom(400)) for _ in range(10)]
+        buf, offsets = snappy.compress_many(arrays, packed=True)
+        self.assertEqual(snappy.decompress_many(buf, offsets),
+                         [a.tobytes() for a in arrays])
+
+
 class SnappyValidBufferTest(TestCase):
 
     def test_valid_compressed_buffer(self):
@@ -134,6 +283,77 @@ class SnappyStreaming(TestCase):
             decompressor.flush()
             self.assertEqual(len(data), 0)
 
+    def test_max_length(self):
+        data = os.urandom(1000) * 100 + os.urandom(snappy.snappy._CHUNK_MAX)
+        compressed = snappy.StreamCompressor().compress(data)
+        for max_length in (100, 1000, snappy.snappy._CHUNK_MAX + 1):
+            decompressor = snappy.StreamDecompressor()
+            out = b""
+            for i in range(0, len(compressed), 5000):
+                chunk = decompressor.decompress(compressed[i:i + 5000],
+                                                max_length)
+                self.assertLessEqual(len(chunk), max_length)
+                out += chunk
+                while not decompressor.needs_input:
+                    chunk = decompressor.decompress(b"", max_length)
+                    self.assertLessEqual(len(chunk), max_length)
+                    out += chunk
+            self.assertEqual(out, data)
+            self.assertEqual(decompressor.flush(), b"")
+
+    def test_max_length_flush(self):
+        data = b"snappy" * 100000
+        compressed = snappy.StreamCompressor().compress(data)
+        decompressor = snappy.StreamDecompressor()
+        out = decompressor.decompress(compressed, max_length=10)
+        self.assertEqual(out, data[:10])
+        self.assertFalse(decompressor.needs_input)
+        self.assertEqual(out + decompressor.flush(), data)
+        self.assertRaises(ValueError, decompressor.decompress, b"", -1)
+
+    def test_max_length_mixed(self):
+        data = os.urandom(1000) * 200
+        compressed = snappy.StreamCompressor().compress(data)
+        decompressor = snappy.StreamDecompressor()
+        out = decompressor.decompress(compressed[:30000], max_length=100)
+        self.assertEqual(len(out), 100)
+        # an unlimited call returns the pending output and decodes on
+        out += decompressor.decompress(b"")
+        self.assertTrue(decompressor.needs_input)
+        out += decompressor.decompress(compressed[30000:], max_length=500)
+        out += decompressor.decompress(b"")
+        self.assertEqual(out, data)
+
+    def test_max_length_linear(self):
+        # decoding a large buffered input in small steps must not move the
+        # rest of the buffer on every call
+        def best_time(size):
+            data = os.urandom(size)
+            compressed = snappy.StreamCompressor().compress(data)
+            timings = []
+            for _ in range(3):
+                decompressor = snappy.StreamDecompressor()
+                start = time.perf_counter()
+                out = [decompressor.decompress(compressed, 65536)]
+                while not decompressor.needs_input:
+                    out.append(decompressor.decompress(b"", 65536))
+                timings.append(time.perf_counter() - start)
+            self.assertEqual(b"".join(out), data)
+            return min(timings)
+
+        # four times the input, about 4x the time (16x when quadratic)
+        ratio = best_time(16 * 2**20) / best_time(4 * 2**20)
+        self.assertLess(ratio, 9)
+
+    def test_incomplete_chunk(self):
+        compressed = snappy.StreamCompressor().compress(b"snappy" * 100)
+        decompressor = snappy.StreamDecompressor()
+        self.assertEqual(decompressor.decompress(compressed[:-3]), b"")
+        self.assertEqual(decompressor.remains, compressed[10:-3])
+        self.assertEqual(decompressor.decompress(compressed[-3:]),
+                         b"snappy" * 100)
+        self.assertEqual(decompressor.remains, b"")
+
     def test_concatenation(self):
         data1 = os.urandom(snappy.snappy._CHUNK_MAX * 2)
         data2 = os.urandom(4096)
@@ -145,6 +365,996 @@ class SnappyStreaming(TestCase):
                 data1 + data2)
 
 
+class SnappyHadoopStreaming(TestCase):
+
+    @staticmethod
+    def hadoop_block(*parts):
+        out = [sum(map(len, parts)).to_bytes(4, "big")]
+        for part in parts:
+            compressed = snappy.compress(part)
+            out.append(len(compressed).to_bytes(4, "big") + compressed)
+        return b"".join(out)
+
+    def test_sub_blocks(self):
+        parts = [os.urandom(random.randint(1, 5000)) for _ in range(30)]
+        stream = b"".join(self.hadoop_block(*parts[i:i + 7])
+                          for i in range(0, len(parts), 7))
+        for size in (1, 3, 100, len(stream)):
+            decompressor = snappy.HadoopStreamDecompressor()
+            out = b"".join(decompressor.decompress(stream[i:i + size])
+                           for i in range(0, len(stream), size))
+            decompressor.flush()
+            self.assertEqual(out, b"".join(parts))
+
+    def test_many_small_blocks(self):
+        data = os.urandom(4096) * 256
+        compressor = snappy.HadoopStreamCompressor()
+        stream = b"".join(compressor.add_chunk(data[i:i + 4096])
+                          for i in range(0, len(data), 4096))
+        decompressor = snappy.HadoopStreamDecompressor()
+        self.assertEqual(decompressor.decompress(stream), data)
+        self.assertEqual(compressor.add_chunk(b""), b"")
+
+    def test_compress_sub_blocks(self):
+        data = b"".join(os.urandom(100) * 50 for _ in range(200))
+        compressor = snappy.HadoopStreamCompressor(subblock_size=10000)
+        chunk = data[:65536]
+        block = compressor.add_chunk(chunk)
+        parts = [chunk[i:i + 10000] for i in range(0, len(chunk), 10000)]
+        self.assertEqual(block, self.hadoop_block(*parts))
+
+        expected = io.BytesIO()
+        snappy.snappy.hadoop_stream_compress(
+            io.BytesIO(data), expected, blocksize=256 * 1024,
+            subblock_size=218422)
+        for workers in (2, None):
+            out = io.BytesIO()
+            snappy.snappy.hadoop_stream_compress(
+                io.BytesIO(data), out, blocksize=256 * 1024,
+                subblock_size=218422, workers=workers)
+            self.assertEqual(out.getvalue(), expected.getvalue())
+        decompressor = snappy.HadoopStreamDecompressor()
+        self.assertEqual(decompressor.decompress(expected.getvalue()), data)
+
+    def test_errors(self):
+        block = self.hadoop_block(b"hello", b"world")
+        decompressor = snappy.HadoopStreamDecompressor()
+        decompressor.decompress(block[:-1])
+        self.assertRaises(snappy.UncompressError, decompressor.flush)
+
+        bad_length = (3).to_bytes(4, "big") + block[4:]
+        self.assertRaises(snappy.UncompressError,
+                          snappy.HadoopStreamDecompressor().decompress,
+                          bad_length)
+
+
+class SnappyAdaptiveStreaming(TestCase):
+
+    def setUp(self):
+        self.random = os.urandom(snappy.snappy._CHUNK_MAX)
+        self.text = b"snappy adaptive " * (snappy.snappy._CHUNK_MAX // 16)
+
+    @staticmethod
+    def chunk_types(compressed):
+        pos, types = 0, []
+        while pos < len(compressed):
+            types.append(compressed[pos])
+            pos += 4 + int.from_bytes(compressed[pos + 1:pos + 4], "little")
+        return types
+
+    def test_framing(self):
+        data = self.random + self.text + self.random[:1000] + self.text
+        for min_savings in (0.05, 0.125, 0.5):
+            compressor = snappy.StreamCompressor(adaptive=True,
+                                                 min_savings=min_savings)
+            compressed = compressor.add_chunk(data)
+            self.assertEqual(self.chunk_types(compressed),
+                             [0xff, 0x01, 0x00, 0x00, 0x00])
+            self.assertEqual(snappy.StreamDecompressor().decompress(
+                compressed), data)
+
+    def test_framing_crc32c(self):
+        # with a native CRC-32C, pieces that look incompressible are stored
+        # without running them through the framing compressor at all
+        data = self.random + self.text + self.random
+        for fast in (True, False):
+            with mock.patch.object(snappy.snappy, "_FAST_CRC32C", fast), \
+                    mock.patch.object(cramjam.snappy, "compress",
+                                      wraps=cramjam.snappy.compress) as framed:
+                compressor = snappy.StreamCompressor(adaptive=True)
+                compressed = compressor.add_chunk(data)
+            self.assertEqual(framed.call_count, 1 if fast else 3)
+            self.assertEqual(self.chunk_types(compressed),
+                             [0xff, 0x01, 0x00, 0x01])
+            self.assertEqual(snappy.StreamDecompressor().decompress(
+                compressed), data)
+
+    def test_store(self):
+        compressor = snappy.StreamCompressor()
+        compressed = compressor.add_chunk(self.text, compress=False)
+        self.assertEqual(self.chunk_types(compressed), [0xff, 0x01])
+        self.assertEqual(snappy.StreamDecompressor().decompress(compressed),
+                         self.text)
+
+    def test_stream_compress(self):
+        data = (self.random + self.text) * 3
+        for workers in (1, 3):
+            compressed = io.BytesIO()
+            snappy.stream_compress(io.BytesIO(data), compressed,
+                                   workers=workers, adaptive=True)
+            out = io.BytesIO()
+            snappy.stream_decompress(io.BytesIO(compressed.getvalue()), out)
+            self.assertEqual(out.getvalue(), data)
+
+    def test_hadoop(self):
+        compressor = snappy.HadoopStreamCompressor(adaptive=True)
+        decompressor = snappy.HadoopStreamDecompressor()
+        for data in (self.random, self.text, self.random[:100], b"x"):
+            compressed = compressor.add_chunk(data)
+            self.assertEqual(decompressor.decompress(compressed), data)
+        literal = compressor.add_chunk(self.random)
+        self.assertLess(len(literal), len(self.random) + 16)
+
+    def test_crc32c(self):
+        from snappy import snappy_crc32c
+        self.assertEqual(snappy_crc32c.crc32c(b"123456789"), 0xE3069283)
+        self.assertEqual(
+            snappy_crc32c.crc32c(b"6789", snappy_crc32c.crc32c(b"12345")),
+            0xE3069283)
+
+
+class SnappyBufferedStreaming(TestCase):
+
+    chunk_types = staticmethod(SnappyAdaptiveStreaming.chunk_types)
+
+    def test_coalescing(self):
+        records = [b'{"event": %d, "kind": "click"}\n' % i
+                   for i in range(10000)]
+        compressor = snappy.StreamCompressor(buffered=True)
+        outputs = [compressor.add_chunk(record) for record in records]
+        compressed = b"".join(outputs) + compressor.flush()
+        data = b"".join(records)
+        self.assertEqual(compressed, snappy.StreamCompressor().add_chunk(data))
+        self.assertEqual(sum(1 for out in outputs if out),
+                         len(data) // snappy.snappy._CHUNK_MAX)
+        self.assertEqual(compressor.flush(), b"")
+
+    def test_large_and_sync_flush(self):
+        compressor = snappy.StreamCompressor(buffered=True)
+        data = os.urandom(1000) * 200
+        out = compressor.add_chunk(data[:10])
+        self.assertEqual(out, b"")
+        self.assertEqual(compressor.flush(zlib.Z_NO_FLUSH), b"")
+        out += compressor.add_chunk(data[10:])
+        self.assertEqual(self.chunk_types(out), [0xff, 0x00, 0x00, 0x00])
+        out += compressor.flush(zlib.Z_SYNC_FLUSH)
+        out += compressor.add_chunk(b"tail")
+        out += compressor.flush(zlib.Z_FULL_FLUSH)
+        # snappy stores the short tail uncompressed
+        self.assertEqual(self.chunk_types(out), [0xff] + [0x00] * 4 + [0x01])
+        self.assertEqual(snappy.StreamDecompressor().decompress(out),
+                         data + b"tail")
+
+    def test_store_copy_reset(self):
+        compressor = snappy.StreamCompressor(buffered=True)
+        compressor.add_chunk(b"a" * 100)
+        other = compressor.copy()
+        out = compressor.add_chunk(b"b" * 100, compress=False)
+        self.assertEqual(self.chunk_types(out), [0xff, 0x00, 0x01])
+        self.assertEqual(snappy.StreamDecompressor().decompress(out),
+                         b"a" * 100 + b"b" * 100)
+        self.assertEqual(snappy.StreamDecompressor().decompress(
+            other.flush()), b"a" * 100)
+        compressor.add_chunk(b"c")
+        compressor.reset()
+        self.assertEqual(compressor.flush(), b"")
+
+
+class SnappyParallelStreaming(TestCase):
+
+    def _compress(self, data, **kwargs):
+        dst = io.BytesIO()
+        snappy.stream_compress(io.BytesIO(data), dst, **kwargs)
+        return dst.getvalue()
+
+    def test_identical_to_serial(self):
+        data = (os.urandom(100000) + b"snappy" * 50000) * 3
+        for blocksize in (1000, snappy.snappy._CHUNK_MAX, 200000):
+            self.assertEqual(
+                self._compress(data, blocksize=blocksize, workers=4),
+                self._compress(data, blocksize=blocksize))
+
+    def test_roundtrip(self):
+        data = os.urandom(snappy.snappy._CHUNK_MAX * 5 + 123)
+        compressed = self._compress(data, workers=None)
+        dst = io.BytesIO()
+        snappy.stream_decompress(io.BytesIO(compressed), dst)
+        self.assertEqual(dst.getvalue(), data)
+
+    def test_empty(self):
+        self.assertEqual(self._compress(b"", workers=4), b"")
+
+    def test_parallel_decompress(self):
+        data = (os.urandom(100000) + b"snappy" * 50000) * 4
+        compressed = (self._compress(data[:300000]) +
+                      self._compress(data[300000:]))
+        decompressor = snappy.StreamDecompressor(workers=3)
+        out = b""
+        for i in range(0, len(compressed), 100000):
+            out += decompressor.decompress(compressed[i:i + 100000])
+        decompressor.flush()
+        self.assertEqual(out, data)
+
+        dst = io.BytesIO()
+        snappy.stream_decompress(io.BytesIO(compressed), dst, workers=4)
+        self.assertEqual(dst.getvalue(), data)
+
+    def test_parallel_decompress_corrupt(self):
+        compressed = bytearray(self._compress(b"snappy" * 50000))
+        compressed[-1] ^= 0xff
+        decompressor = snappy.StreamDecompressor(workers=2)
+        self.assertRaises(snappy.UncompressError,
+                          decompressor.decompress, bytes(compressed))
+
+
+class SnappyIndexTest(TestCase):
+
+    def setUp(self):
+        self.data = b"".join(
+            os.urandom(random.randint(0, 1000)) + b"snappy" * 20000
+            for _ in range(5))
+        compressed = io.BytesIO()
+        snappy.stream_compress(io.BytesIO(self.data), compressed,
+                               blocksize=50000)
+        self.compressed = compressed
+
+    def test_read(self):
+        reader = snappy.SeekableFramedReader(self.compressed)
+        self.assertEqual(reader.size, len(self.data))
+        self.assertGreater(len(reader.index), 1)
+        for _ in range(50):
+            offset = random.randint(0, len(self.data))
+            length = random.randint(0, 200000)
+            self.assertEqual(reader.read(offset, length),
+                             self.data[offset:offset + length])
+        self.assertEqual(reader.read(len(self.data) + 10, 10), b"")
+
+    def test_sidecar(self):
+        index = snappy.FramedIndex.build(self.compressed)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "data.sz.idx")
+            index.save(path)
+            loaded = snappy.FramedIndex.load(path)
+        self.assertEqual(loaded.chunk_offsets, index.chunk_offsets)
+        self.assertEqual(loaded.data_offsets, index.data_offsets)
+        reader = snappy.SeekableFramedReader(self.compressed, loaded)
+        self.assertEqual(reader.read(123456, 1000),
+                         self.data[123456:124456])
+
+    def test_invalid(self):
+        self.assertRaises(snappy.UncompressError, snappy.FramedIndex.build,
+                          io.BytesIO(b"not snappy"))
+        truncated = io.BytesIO(self.compressed.getvalue()[:-1])
+        self.assertRaises(snappy.UncompressError, snappy.FramedIndex.build,
+                          truncated)
+
+
+class SnappyFileTest(TestCase):
+
+    def setUp(self):
+        self.lines = [("line %d %s\n" % (i, "x" * random.randint(0, 300)))
+                      .encode("ascii") for i in range(2000)]
+        self.data = b"".join(self.lines)
+
+    def test_roundtrip(self):
+        for form in ("framing", "hadoop", "raw"):
+            buf = io.BytesIO()
+            with snappy.open(buf, "wb", format=form) as f:
+                for line in self.lines:
+                    f.write(line)
+                self.assertEqual(f.tell(), len(self.data))
+            buf.seek(0)
+            with snappy.open(buf, "rb", format=form) as f:
+                self.assertEqual(f.peek()[:10], self.data[:10])
+                self.assertEqual(list(f), self.lines)
+            if form == "framing":
+                buf.seek(0)
+                with snappy.open(buf, "rb", format="auto") as f:
+                    self.assertEqual(f.read(), self.data)
+
+    def test_readinto(self):
+        buf = io.BytesIO(snappy.StreamCompressor().compress(self.data))
+        out = bytearray(len(self.data) + 10)
+        with snappy.open(buf) as f:
+            self.assertEqual(f.readinto(out), len(self.data))
+            self.assertEqual(f.readinto(out), 0)
+        self.assertEqual(out[:len(self.data)], self.data)
+
+    def test_writes_full_chunks(self):
+        buf = io.BytesIO()
+        f = snappy.SnappyFile(fileobj=buf, mode="wb")
+        for line in self.lines:
+            f.write(line)
+        f.close()
+        expected = io.BytesIO()
+        snappy.stream_compress(io.BytesIO(self.data), expected)
+        self.assertEqual(buf.getvalue(), expected.getvalue())
+
+    def test_text_mode(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "data.sz")
+            with snappy.open(path, "wt", encoding="utf-8") as f:
+                f.write(u"h\u00e9llo\nworld\n")
+            with snappy.open(path, "rt", encoding="utf-8") as f:
+                self.assertEqual(f.readlines(), [u"h\u00e9llo\n", u"world\n"])
+
+    def test_truncated(self):
+        compressed = snappy.StreamCompressor().compress(self.data)
+        with snappy.open(io.BytesIO(compressed[:-1])) as f:
+            self.assertRaises(snappy.UncompressError, f.read)
+
+    def test_invalid_arguments(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "data.sz")
+            for mode, form in (("ab", "raw"), ("wb", "zip"), ("wb", "auto"),
+                               ("rb", "zip")):
+                with self.assertRaises(ValueError):
+                    snappy.open(path, mode, format=form)
+            # rejected before the file was opened
+            self.assertFalse(os.path.exists(path))
+
+
+class SnappyAsyncTest(TestCase):
+
+    class Writer():
+        def __init__(self):
+            self.data = b""
+            self.drained = 0
+
+        def write(self, data):
+            self.data += data
+
+        async def drain(self):
+            self.drained += 1
+
+    @staticmethod
+    async def pieces(data, size):
+        for i in range(0, len(data), size):
+            yield data[i:i + size]
+
+    def test_roundtrip(self):
+        data = os.urandom(100000) + b"snappy" * 100000
+
+        async def run():
+            compressed = self.Writer()
+            await snappy.async_stream_compress(self.pieces(data, 1000),
+                                               compressed)
+            self.assertGreater(compressed.drained, 0)
+
+            reader = asyncio.StreamReader()
+            reader.feed_data(compressed.data)
+            reader.feed_eof()
+            out = self.Writer()
+            await snappy.async_stream_decompress(reader, out)
+            return compressed.data, out.data
+
+        compressed, out = asyncio.run(run())
+        self.assertEqual(out, data)
+        expected = io.BytesIO()
+        snappy.stream_compress(io.BytesIO(data), expected)
+        self.assertEqual(compressed, expected.getvalue())
+
+    def test_hadoop(self):
+        data = b"snappy" * 100000
+
+        async def run():
+            compressed = b""
+            async for buf in snappy.aiter_compress(
+                    self.pieces(data, 70000),
+                    compressor_cls=snappy.HadoopStreamCompressor):
+                compressed += buf
+            out = []
+            async for buf in snappy.aiter_decompress(
+                    self.pieces(compressed, 777),
+                    decompressor_cls=snappy.HadoopStreamDecompressor):
+                out.append(buf)
+            return b"".join(out)
+
+        self.assertEqual(asyncio.run(run()), data)
+
+    def test_reblocking(self):
+        data = os.urandom(1000) * 400
+        sizes = [1, 10, 100, 70000, 3, 200000, 65536]
+
+        async def source():
+            pos = 0
+            for size in sizes:
+                yield data[pos:pos + size]
+                pos += size
+            yield data[pos:]
+
+        async def run():
+            return [buf async for buf in snappy.aiter_compress(source())]
+
+        # the same chunks as the synchronous counterpart
+        pieces = [data[:1], data[1:11], data[11:111], data[111:]]
+        self.assertEqual(asyncio.run(run()),
+                         list(snappy.iter_compress(pieces)))
+
+
+class SnappyChecksumTest(TestCase):
+
+    def setUp(self):
+        self.data = b"".join(os.urandom(100) * 500 for _ in range(6))
+        stream = io.BytesIO()
+        snappy.stream_compress(io.BytesIO(self.data), stream)
+        self.stream = stream.getvalue()
+
+    def corrupt(self, chunk):
+        """Flip the CRC of the chunk-th data chunk."""
+        stream = bytearray(self.stream)
+        pos = len(snappy.snappy._STREAM_HEADER_BLOCK)
+        for _ in range(chunk):
+            pos += 4 + int.from_bytes(stream[pos + 1:pos + 4], "little")
+        stream[pos + 4] ^= 0xff
+        return bytes(stream)
+
+    def decompress(self, stream, **kwargs):
+        out = io.BytesIO()
+        snappy.stream_decompress(io.BytesIO(stream), out, blocksize=100000,
+                                 **kwargs)
+        return out.getvalue()
+
+    def test_verify(self):
+        for workers in (1, 2):
+            stream = self.corrupt(1)
+            with self.assertRaises(snappy.UncompressError):
+                self.decompress(stream, workers=workers)
+            self.assertEqual(
+                self.decompress(stream, workers=workers, verify=False),
+                self.data)
+            with self.assertRaises(snappy.UncompressError):
+                self.decompress(self.corrupt(2), workers=workers, verify=2)
+            self.assertEqual(
+                self.decompress(self.corrupt(3), workers=workers, verify=2),
+                self.data)
+
+    def test_skipped_chunks_are_decoded(self):
+        garbage = b"\x05\xff\xff"
+        chunk = (b"\x00" + (4 + len(garbage)).to_bytes(3, "little") +
+                 b"\x00" * 4 + garbage)
+        with self.assertRaises(snappy.UncompressError):
+            self.decompress(snappy.snappy._STREAM_HEADER_BLOCK + chunk,
+                            verify=False)
+        self.assertRaises(ValueError, snappy.StreamDecompressor, verify=-1)
+
+    def test_crc32c(self):
+        self.assertEqual(snappy.crc32c(b"123456789"), 0xe3069283)
+        self.assertEqual(snappy.crc32c(b"6789", snappy.crc32c(b"12345")),
+                         0xe3069283)
+        # the masked checksum of the first chunk, as cramjam wrote it
+        pos = len(snappy.snappy._STREAM_HEADER_BLOCK)
+        crc = int.from_bytes(self.stream[pos + 4:pos + 8], "little")
+        self.assertEqual(snappy.masked_crc32c(self.data[:65536]), crc)
+
+
+class SnappyArrayTest(TestCase):
+
+    def test_shuffle(self):
+        data = os.urandom(1003)
+        for itemsize in (1, 2, 4, 8):
+            shuffled = snappy.shuffle_bytes(data, itemsize)
+            self.assertEqual(snappy.unshuffle_bytes(shuffled, itemsize), data)
+            with mock.patch.object(snappy.snappy_array, "_loaded_numpy",
+                                   return_value=None):
+                self.assertEqual(snappy.shuffle_bytes(data, itemsize),
+                                 shuffled)
+                self.assertEqual(
+                    snappy.unshuffle_bytes(shuffled, itemsize), data)
+        self.assertEqual(snappy.shuffle_bytes(b"abcdefghij", 4),
+                         b"aebfcgdhij")
+
+    def test_compress_buffer(self):
+        values = array.array("i", range(10000))
+        for shuffle in (False, True):
+            compressed = snappy.compress_array(values, shuffle=shuffle)
+            data = snappy.uncompress(compressed)
+            if shuffle:
+                data = snappy.unshuffle_bytes(data, values.itemsize)
+            self.assertEqual(data, values.tobytes())
+        self.assertLess(len(snappy.compress_array(values, shuffle=True)),
+                        len(snappy.compress_array(values)))
+
+    @skipIf(numpy is None, "numpy is not installed")
+    def test_numpy(self):
+        values = numpy.cumsum(numpy.arange(30000)).astype("f8")
+        for shuffle in (False, True):
+            compressed = snappy.compress_array(values, shuffle=shuffle)
+            out = snappy.decompress_array(compressed, "f8", shuffle=shuffle)
+            numpy.testing.assert_array_equal(out, values)
+            grid = numpy.empty((100, 300), "f8")
+            result = snappy.decompress_array(compressed, out=grid,
+                                             shuffle=shuffle)
+            self.assertIs(result, grid)
+            numpy.testing.assert_array_equal(grid.ravel(), values)
+        # non-contiguous input is copied first
+        matrix = values.reshape(100, 300)
+        compressed = snappy.compress_array(matrix.T)
+        out = snappy.decompress_array(compressed, "f8", (300, 100))
+        numpy.testing.assert_array_equal(out, matrix.T)
+
+    @skipIf(numpy is None, "numpy is not installed")
+    def test_numpy_errors(self):
+        compressed = snappy.compress_array(numpy.arange(10, dtype="i8"))
+        with self.assertRaises(ValueError):
+            snappy.decompress_array(compressed, "i8", (3, 3))
+        with self.assertRaises(ValueError):
+            snappy.decompress_array(compressed, out=numpy.empty(9, "i8"))
+        with self.assertRaises(ValueError):
+            snappy.decompress_array(compressed,
+                                    out=numpy.empty((10, 2), "i8")[:, 0])
+        with self.assertRaises(snappy.UncompressError):
+            snappy.decompress_array(compressed, "i8", max_output_size=79)
+
+
+class SnappyPoolTest(TestCase):
+
+    def test_context_pool(self):
+        pool = snappy.ContextPool(snappy.StreamDecompressor, maxsize=1)
+        compressed = snappy.StreamCompressor().add_chunk(b"pooled" * 1000)
+        for _ in range(3):
+            with pool.borrow() as decompressor:
+                # an incomplete chunk is dropped by reset
+                decompressor.decompress(compressed[:-5])
+        with pool.borrow() as decompressor:
+            self.assertEqual(decompressor.decompress(compressed),
+                             b"pooled" * 1000)
+        self.assertEqual(pool.stats(),
+                         {"hits": 3, "misses": 1, "idle": 1})
+
+    def test_context_pool_threads(self):
+        pool = snappy.ContextPool(snappy.StreamCompressor)
+        data = [os.urandom(100) * random.randint(1, 50) for _ in range(200)]
+
+        def roundtrip(buf):
+            with pool.borrow() as compressor:
+                compressed = compressor.add_chunk(buf)
+            return snappy.StreamDecompressor().decompress(compressed)
+
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            self.assertEqual(list(executor.map(roundtrip, data)), data)
+        stats = pool.stats()
+        self.assertEqual(stats["hits"] + stats["misses"], len(data))
+
+    def test_reset(self):
+        compressed = io.BytesIO()
+        snappy.snappy.hadoop_stream_compress(io.BytesIO(b"x" * 1000),
+                                             compressed)
+        decompressor = snappy.HadoopStreamDecompressor()
+        decompressor.decompress(compressed.getvalue()[:-3])
+        decompressor.reset()
+        self.assertEqual(decompressor.decompress(compressed.getvalue()),
+                         b"x" * 1000)
+        compressor = snappy.StreamCompressor()
+        first = compressor.add_chunk(b"data")
+        compressor.reset()
+        self.assertEqual(compressor.add_chunk(b"data"), first)
+
+    def test_buffer_pool(self):
+        pool = snappy.BufferPool(max_per_class=2, max_size=2**20)
+        data = b"buffer pool " * 1000
+        for _ in range(3):
+            compressed = pool.compress(data)
+            self.assertEqual(bytes(compressed), snappy.compress(data))
+            uncompressed = pool.uncompress(compressed)
+            self.assertEqual(uncompressed, data)
+            pool.release(compressed)
+            pool.release(uncompressed)
+        stats = pool.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (4, 2))
+        buf = pool.acquire(5000)
+        self.assertEqual(len(buf), 8192)
+        pool.release(buf)
+        pool.release(bytearray(8192))
+        pool.release(bytearray(8192))
+        self.assertEqual(pool.stats()["dropped"], 1)
+        # too large to be pooled
+        self.assertEqual(len(pool.acquire(2**20 + 1)), 2**20 + 1)
+        with self.assertRaises(snappy.UncompressError):
+            pool.uncompress(snappy.compress(data), max_output_size=100)
+
+    def test_buffer_pool_argument(self):
+        # both outputs are in the same size class
+        pool = snappy.BufferPool(max_per_class=2)
+        data = b"pooled by argument " * 1000
+        expected = snappy.compress(data)
+        for enabled in (False, True):
+            if enabled:
+                metrics = snappy.enable_metrics()
+                self.addCleanup(snappy.disable_metrics)
+            compressed = snappy.compress(data, pool=pool)
+            self.assertIsInstance(compressed, memoryview)
+            self.assertEqual(bytes(compressed), expected)
+            out = snappy.uncompress(compressed, pool=pool)
+            self.assertEqual(out, data)
+            pool.release(out)
+            # decoded text releases the buffer itself
+            self.assertEqual(snappy.uncompress(compressed, decoding="ascii",
+                                               pool=pool), data.decode())
+            pool.release(compressed)
+        self.assertEqual(pool.stats()["hits"], 4)
+        self.assertEqual(metrics.snapshot()[("compress", "raw")]["bytes_out"],
+                         len(expected))
+
+
+class SnappyTranscodeTest(TestCase):
+
+    def setUp(self):
+        self.data = os.urandom(100000) + b"snappy" * 50000
+        self.streams = {}
+        for form, func in (("framing", snappy.stream_compress),
+                           ("hadoop", snappy.snappy.hadoop_stream_compress),
+                           ("raw", snappy.snappy.raw_stream_compress)):
+            out = io.BytesIO()
+            func(io.BytesIO(self.data), out)
+            self.streams[form] = out.getvalue()
+
+    def decompress(self, form, data):
+        funcs = {"framing": snappy.stream_decompress,
+                 "hadoop": snappy.snappy.hadoop_stream_decompress,
+                 "raw": snappy.snappy.raw_stream_decompress}
+        out = io.BytesIO()
+        funcs[form](io.BytesIO(data), out)
+        return out.getvalue()
+
+    def test_all_pairs(self):
+        for source, stream in self.streams.items():
+            for target in self.streams:
+                for from_format in (source, "auto"):
+                    out = io.BytesIO()
+                    snappy.transcode(io.BytesIO(stream), out, from_format,
+                                     target)
+                    self.assertEqual(
+                        self.decompress(target, out.getvalue()), self.data)
+
+    def test_payloads_reused(self):
+        framing = io.BytesIO()
+        snappy.stream_compress(io.BytesIO(b"snappy" * 50000), framing)
+        framing = framing.getvalue()
+        out = io.BytesIO()
+        snappy.transcode(io.BytesIO(framing), out, "framing", "hadoop")
+        hadoop = out.getvalue()
+        # every framing chunk header (8 bytes) became a hadoop block header
+        header = snappy.snappy._STREAM_HEADER_BLOCK
+        self.assertEqual(len(hadoop), len(framing) - len(header))
+        out = io.BytesIO()
+        snappy.transcode(io.BytesIO(hadoop), out, "hadoop", "framing")
+        self.assertEqual(out.getvalue(), framing)
+
+    @staticmethod
+    def frame_payloads(stream):
+        """The chunk types and payloads of a framing stream."""
+        pos = len(snappy.snappy._STREAM_HEADER_BLOCK)
+        chunks = []
+        while pos < len(stream):
+            end = pos + 4 + int.from_bytes(stream[pos + 1:pos + 4], "little")
+            chunks.append((stream[pos], stream[pos + 8:end]))
+            pos = end
+        return chunks
+
+    def test_payloads_reused_with_crc32c(self):
+        # payloads stored as literals, which compressing again would shrink
+        pieces = [os.urandom(100) * 400 for _ in range(3)]
+        literals = [snappy.snappy._literal_block(p) for p in pieces]
+        compressor = snappy.HadoopStreamCompressor()
+        hadoop = b"".join(compressor.add_chunk(p, compress=False)
+                          for p in pieces)
+        streams = {"hadoop": (hadoop, literals),
+                   "raw": (literals[0], literals[:1])}
+        for fast in (True, False):
+            for form, (stream, payloads) in streams.items():
+                with mock.patch.object(snappy.snappy_transcode,
+                                       "_FAST_CRC32C", fast):
+                    out = io.BytesIO()
+                    snappy.transcode(io.BytesIO(stream), out, form, "framing")
+                out = out.getvalue()
+                chunks = self.frame_payloads(out)
+                if fast:
+                    # the same bytes, with only the framing rewritten
+                    self.assertEqual(chunks, [(0x00, p) for p in payloads])
+                else:
+                    self.assertTrue(all(len(payload) < len(literal)
+                                        for (_, payload), literal
+                                        in zip(chunks, payloads)))
+                self.assertEqual(self.decompress("framing", out),
+                                 b"".join(pieces[:len(payloads)]))
+
+    def test_corrupt_checksum(self):
+        stream = bytearray(self.streams["framing"])
+        stream[14] ^= 0xff  # CRC of the first chunk
+        with self.assertRaises(snappy.UncompressError):
+            snappy.transcode(io.BytesIO(stream), io.BytesIO(), "framing",
+                             "hadoop")
+        snappy.transcode(io.BytesIO(stream), io.BytesIO(), "framing",
+                         "hadoop", verify=False)
+
+    def test_truncated(self):
+        for form in ("framing", "hadoop"):
+            with self.assertRaises(snappy.UncompressError):
+                snappy.transcode(io.BytesIO(self.streams[form][:-10]),
+                                 io.BytesIO(), form, "raw")
+
+
+class SnappyIterTest(TestCase):
+
+    def pieces(self, data, sizes):
+        pos = 0
+        for size in sizes:
+            yield data[pos:pos + size]
+            pos += size
+        yield data[pos:]
+
+    def test_reblocking(self):
+        data = os.urandom(1000) * 400
+        sizes = [1, 10, 100, 70000, 3, 200000]
+        chunks = list(snappy.iter_compress(self.pieces(data, sizes)))
+        expected = io.BytesIO()
+        snappy.stream_compress(io.BytesIO(data), expected)
+        self.assertEqual(b"".join(chunks), expected.getvalue())
+        out = list(snappy.iter_decompress(self.pieces(b"".join(chunks),
+                                                      [5, 50000])))
+        self.assertEqual(b"".join(out), data)
+        self.assertLessEqual(max(map(len, out)), 65536)
+
+    def test_formats(self):
+        data = b"iterable " * 30000
+        for form in ("framing", "hadoop", "raw"):
+            chunks = list(snappy.iter_compress(iter([data[:10], data[10:]]),
+                                               format=form, blocksize=40000))
+            for decode_as in (form, "auto"):
+                out = snappy.iter_decompress(chunks, format=decode_as)
+                self.assertEqual(b"".join(out), data)
+
+    def test_lazy(self):
+        def source():
+            yield b"a" * 100000
+            raise RuntimeError("read too far")
+        chunks = snappy.iter_compress(source())
+        self.assertEqual(len(next(chunks)), len(snappy.StreamCompressor()
+                                                 .add_chunk(b"a" * 65536)))
+
+    def test_errors(self):
+        compressed = b"".join(snappy.iter_compress([b"a" * 100000]))
+        with self.assertRaises(snappy.UncompressError):
+            list(snappy.iter_decompress([compressed], max_output_size=1000))
+        with self.assertRaises(ValueError):
+            list(snappy.iter_compress([b"a"], format="zip"))
+
+
+class SnappyDictionaryTest(TestCase):
+
+    def setUp(self):
+        rng = random.Random(0)
+        self.messages = [
+            ('{"event_id": %d, "type": "%s", "user": "user-%d", '
+             '"page": {"url": "https://example.com/p/%d"}}'
+             % (i, rng.choice(["click", "view"]), rng.randint(1, 5000),
+                rng.randint(1, 100))).encode()
+            for i in range(600)]
+        self.dictionary = snappy.train_dictionary(self.messages[:300])
+
+    def test_roundtrip(self):
+        dictionary = self.dictionary
+        self.assertLessEqual(len(dictionary.data), 4096)
+        with_dict = without = 0
+        for message in self.messages[300:]:
+            compressed = dictionary.compress(message)
+            self.assertEqual(dictionary.decompress(compressed), message)
+            with_dict += len(compressed)
+            without += len(snappy.compress(message))
+        self.assertLess(with_dict, without * 0.75)
+
+    def test_any_data(self):
+        dictionary = snappy.Dictionary(b"abcdefgh" * 100 + os.urandom(500))
+        for size in (0, 1, 4, 15, 100, 4000, 70000):
+            data = (dictionary.data[-size // 2:] + os.urandom(size))[:size]
+            compressed = dictionary.compress(data)
+            self.assertEqual(dictionary.uncompress(compressed), data)
+        empty = snappy.Dictionary(b"")
+        self.assertEqual(empty.decompress(empty.compress(b"abc")), b"abc")
+
+    def test_ids(self):
+        other = snappy.Dictionary(b"other dictionary", dict_id=7)
+        compressed = self.dictionary.compress(self.messages[0])
+        self.assertEqual(compressed[0], 0x44)
+        self.assertEqual(snappy.dictionary_id(compressed),
+                         self.dictionary.dict_id)
+        self.assertEqual(self.dictionary.dict_id,
+                         snappy.crc32c(self.dictionary.data))
+        known = {d.dict_id: d for d in (self.dictionary, other)}
+        self.assertEqual(snappy.decompress_with_dictionaries(compressed,
+                                                             known),
+                         self.messages[0])
+        with self.assertRaises(snappy.UncompressError):
+            other.decompress(compressed)
+        with self.assertRaises(snappy.UncompressError):
+            snappy.decompress_with_dictionaries(compressed, {7: other})
+        # framing decoders refuse the chunk instead of skipping it
+        with self.assertRaises(snappy.UncompressError):
+            snappy.StreamDecompressor().decompress(
+                snappy.snappy._STREAM_HEADER_BLOCK + compressed)
+
+    def test_checksum_backends(self):
+        # the native CRC-32C and the fallback reading it from a framed
+        # compression of the message must agree
+        from snappy import snappy_dict
+        messages = self.messages[300:320] + [b""]
+        outputs = {}
+        for fast in (True, False):
+            with mock.patch.object(snappy_dict, "_FAST_CRC32C", fast), \
+                    mock.patch.object(cramjam.snappy, "compress",
+                                      wraps=cramjam.snappy.compress) as framed:
+                compressed = [self.dictionary.compress(m) for m in messages]
+                self.assertEqual([self.dictionary.decompress(c)
+                                  for c in compressed], messages)
+            # two checksums (compress and decompress) per non-empty message
+            self.assertEqual(framed.call_count,
+                             0 if fast else 2 * (len(messages) - 1))
+            for message, data in zip(messages, compressed):
+                self.assertEqual(data[4:8], snappy.masked_crc32c(
+                    message).to_bytes(4, "little"))
+            outputs[fast] = compressed
+        self.assertEqual(outputs[True], outputs[False])
+
+    def test_corrupt(self):
+        compressed = bytearray(self.dictionary.compress(self.messages[0]))
+        compressed[6] ^= 1
+        with self.assertRaises(snappy.UncompressError):
+            self.dictionary.decompress(bytes(compressed))
+        with self.assertRaises(snappy.UncompressError):
+            self.dictionary.decompress(self.dictionary.compress(
+                b"x" * 1000), max_output_size=100)
+        with self.assertRaises(ValueError):
+            snappy.Dictionary(bytes(40000))
+
+
+class SnappyMetricsTest(TestCase):
+
+    def setUp(self):
+        self.metrics = snappy.enable_metrics()
+
+    def tearDown(self):
+        snappy.disable_metrics()
+
+    def test_block_functions(self):
+        data = b"metrics " * 1000
+        compressed = snappy.compress(data)
+        self.assertEqual(snappy.uncompress(compressed), data)
+        snapshot = self.metrics.snapshot()
+        compress = snapshot[("compress", "raw")]
+        self.assertEqual(compress["calls"], 1)
+        self.assertEqual(compress["bytes_in"], len(data))
+        self.assertEqual(compress["bytes_out"], len(compressed))
+        self.assertEqual(compress["ratio"], len(compressed) / len(data))
+        self.assertEqual(sum(compress["latency"]), 1)
+        decompress = snapshot[("decompress", "raw")]
+        self.assertEqual(decompress["bytes_out"], len(data))
+        self.assertEqual(decompress["ratio"], compress["ratio"])
+
+    def test_batch_and_into(self):
+        messages = [b"metrics " * 100, b"batch " * 50]
+        compressed = snappy.compress_many(messages)
+        packed, offsets = snappy.compress_many(messages, packed=True)
+        out = bytearray(snappy.max_compressed_length(messages[0]))
+        written = snappy.compress_into(messages[0], out)
+        self.assertEqual(snappy.decompress_many(packed, offsets), messages)
+        with self.assertRaises(snappy.UncompressError):
+            snappy.decompress_into(b"\xff\xff\xff", bytearray(10))
+        snapshot = self.metrics.snapshot()
+        compress = snapshot[("compress", "raw")]
+        self.assertEqual(compress["calls"], 3)
+        self.assertEqual(compress["bytes_in"],
+                         2 * sum(map(len, messages)) + len(messages[0]))
+        self.assertEqual(compress["bytes_out"],
+                         sum(map(len, compressed)) + len(packed) + written)
+        decompress = snapshot[("decompress", "raw")]
+        self.assertEqual(decompress["bytes_out"], sum(map(len, messages)))
+        self.assertEqual(decompress["errors"], {"corrupt": 1})
+
+    def test_transcode(self):
+        framed = snappy.StreamCompressor().add_chunk(b"transcode " * 1000)
+        self.metrics.reset()
+        out = io.BytesIO()
+        snappy.transcode(io.BytesIO(framed), out, "auto", "hadoop")
+        series = self.metrics.snapshot()[("transcode", "hadoop")]
+        self.assertEqual((series["calls"], series["bytes_in"],
+                          series["bytes_out"]),
+                         (1, len(framed), len(out.getvalue())))
+        # the stream functions used by transcode are not counted again
+        self.assertEqual(list(self.metrics.snapshot()),
+                         [("transcode", "hadoop")])
+
+    def test_errors(self):
+        framed = bytearray(snappy.StreamCompressor().add_chunk(b"a" * 100))
+        # the checksum of the first chunk, after the stream header
+        framed[14] ^= 1
+        with self.assertRaises(snappy.UncompressError):
+            snappy.StreamDecompressor().decompress(bytes(framed))
+        with self.assertRaises(snappy.UncompressError):
+            snappy.uncompress(b"\xff\xff\xff")
+        with self.assertRaises(snappy.UncompressError):
+            snappy.uncompress(snappy.compress(b"a" * 100), max_output_size=10)
+        decompressor = snappy.HadoopStreamDecompressor()
+        decompressor.decompress(b"\x00\x00\x00\x10")
+        with self.assertRaises(snappy.UncompressError):
+            decompressor.flush()
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot[("decompress", "framing")]["errors"],
+                         {"checksum": 1})
+        self.assertEqual(snapshot[("decompress", "raw")]["errors"],
+                         {"corrupt": 1, "output_limit": 1})
+        self.assertEqual(snapshot[("decompress", "hadoop")]["errors"],
+                         {"truncated": 1})
+
+    def test_streams_counted_once(self):
+        data = os.urandom(1000) * 300
+        compressed = io.BytesIO()
+        snappy.stream_compress(io.BytesIO(data), compressed)
+        out = io.BytesIO()
+        snappy.stream_decompress(io.BytesIO(compressed.getvalue()), out,
+                                 workers=2)
+        self.assertEqual(out.getvalue(), data)
+        snappy.snappy.hadoop_stream_compress(io.BytesIO(data), io.BytesIO(),
+                                             workers=2)
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(sorted(snapshot), [("stream_compress", "framing"),
+                                            ("stream_compress", "hadoop"),
+                                            ("stream_decompress", "framing")])
+        series = snapshot[("stream_decompress", "framing")]
+        self.assertEqual(series["calls"], 1)
+        self.assertEqual(series["bytes_in"], len(compressed.getvalue()))
+        self.assertEqual(series["bytes_out"], len(data))
+
+    def test_callback_and_disable(self):
+        calls = []
+        snappy.enable_metrics(lambda *args: calls.append(args))
+        snappy.compress(b"abc")
+        snappy.disable_metrics()
+        snappy.compress(b"abc")
+        self.assertEqual(len(calls), 1)
+        operation, format, bytes_in, bytes_out, seconds, error = calls[0]
+        self.assertEqual((operation, format, bytes_in, error),
+                         ("compress", "raw", 3, None))
+        self.assertEqual(self.metrics.snapshot(), {})
+
+    def test_prometheus(self):
+        snappy.compress(b"abc")
+        text = self.metrics.prometheus()
+        self.assertIn('snappy_calls_total{operation="compress",format="raw"}'
+                      ' 1\n', text)
+        self.assertIn('snappy_duration_seconds_bucket{operation="compress",'
+                      'format="raw",le="+Inf"} 1\n', text)
+        self.assertIn("# TYPE snappy_duration_seconds histogram\n", text)
+
+
+class SnappyBenchTest(TestCase):
+
+    def test_corpora(self):
+        from snappy import bench
+        for name in bench.CORPORA:
+            data = bench.make_corpus(name, 300000)
+            self.assertEqual(len(data), 300000)
+            self.assertEqual(data, bench.make_corpus(name, 300000))
+
+    def test_compare(self):
+        from snappy import bench
+        baseline = {"results": {"a": {"mb_s": 100.0}, "b": {"mb_s": 100.0}}}
+        results = {"results": {"a": {"mb_s": 95.0}, "b": {"mb_s": 80.0},
+                               "c": {"mb_s": 1.0}}}
+        self.assertEqual(bench.compare(results, baseline, 0.1),
+                         [("b", 100.0, 80.0)])
+
+
 if __name__ == "__main__":
     import unittest
     unittest.main()